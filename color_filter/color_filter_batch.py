@@ -0,0 +1,237 @@
+"""
+圖片濾鏡批量處理
+
+使用多進程並行處理大量圖片，可由圖形介面調用，也可直接在命令列運行：
+
+    python color_filter_batch.py -c blue -i 60 sprites/*.png
+    python color_filter_batch.py --gray --bg 255,255,255 --threshold 30 -j 8 sprites/
+    python color_filter_batch.py --chain team_blue.json sprites/
+    python color_filter_batch.py --variants red,blue,green,gray sprites/
+"""
+import argparse
+import glob
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+from color_filter_engine import (COLOR_NAMES, OUTPUT_SUFFIXES, FilterParams, process_file, process_file_variants,
+                                 proxy_difference, variant_params)
+from filter_chain import FilterChain
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+
+class BatchResult:
+    """批量處理結果"""
+
+    def __init__(self, total):
+        self.total = total
+        self.saved = []      # 成功保存的路徑
+        self.errors = []     # (原始路徑, 錯誤訊息)
+        self.cancelled = False
+
+
+def _process_one(file_path, params, strip_bytes):
+    # 在子進程中運行，錯誤以字符串返回，避免異常對象無法跨進程傳遞
+    try:
+        if isinstance(params, (list, tuple)):
+            return file_path, process_file_variants(file_path, params), None
+        return file_path, [process_file(file_path, params, strip_bytes)], None
+    except Exception as e:
+        return file_path, None, str(e)
+
+
+def run_batch(file_paths, params, jobs=None, progress=None, cancel_event=None, strip_bytes=None):
+    """
+    並行處理並保存所有圖片
+
+    Args:
+        file_paths (list): 圖片路徑列表
+        params (FilterParams): 濾鏡參數，也可以是濾鏡鏈（FilterChain），
+            或多個版本的參數列表（每張圖片只解碼一次）
+        jobs (int): 進程數，默認為CPU核心數
+        progress (callable): 每完成一張圖片調用 progress(done, total, file_path, error)
+        cancel_event (threading.Event): 設置後停止提交新任務並盡快返回
+        strip_bytes (int): 按條帶處理時每個條帶的工作內存，默認只對超大圖片按條帶處理
+
+    Returns:
+        BatchResult
+    """
+    file_paths = list(file_paths)
+    result = BatchResult(len(file_paths))
+    if not file_paths:
+        return result
+
+    jobs = jobs or os.cpu_count() or 1
+    cancel_event = cancel_event or threading.Event()
+    pending = iter(file_paths)
+    # 只保持少量任務在途，取消時無需等待整個隊列
+    max_in_flight = jobs * 2
+    done_count = 0
+    broken = False  # 有子進程異常退出（如內存不足）後進程池不再可用
+
+    def finish(file_path, save_paths, error):
+        nonlocal done_count
+        done_count += 1
+        if error is None:
+            result.saved.extend(save_paths)
+        else:
+            result.errors.append((file_path, error))
+        if progress:
+            progress(done_count, result.total, file_path, error)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        running = {}  # Future -> 圖片路徑
+        while True:
+            while not broken and not cancel_event.is_set() and len(running) < max_in_flight:
+                file_path = next(pending, None)
+                if file_path is None:
+                    break
+                try:
+                    running[executor.submit(_process_one, file_path, params, strip_bytes)] = file_path
+                except BrokenProcessPool as e:
+                    broken = True
+                    finish(file_path, None, f"處理進程異常退出: {e}")
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                file_path = running.pop(future)
+                try:
+                    _, save_paths, error = future.result()
+                except BrokenProcessPool as e:
+                    # 在途的其餘任務也會以同樣的錯誤結束
+                    broken = True
+                    save_paths, error = None, f"處理進程異常退出: {e}"
+                except Exception as e:
+                    save_paths, error = None, str(e)
+                finish(file_path, save_paths, error)
+
+    # 進程池損壞後尚未提交的圖片同樣記為失敗
+    if broken:
+        for file_path in pending:
+            finish(file_path, None, "未處理：處理進程異常退出")
+
+    result.cancelled = cancel_event.is_set() and done_count < result.total
+    return result
+
+
+def is_output_name(path, suffixes=OUTPUT_SUFFIXES):
+    """文件名（不含擴展名）以濾鏡輸出的後綴結尾，如 hero_red.png"""
+    return os.path.splitext(os.path.basename(path))[0].endswith(suffixes)
+
+
+def collect_images(patterns, skip_suffixes=OUTPUT_SUFFIXES):
+    """
+    展開文件、文件夾（遞歸）與通配符為圖片路徑列表
+
+    輸出保存在原圖旁邊，文件夾和通配符匹配到的文件名以 skip_suffixes 結尾時跳過，
+    重複運行時不會再處理之前的輸出（如 i0_red.png 變成 i0_red_red.png）；
+    直接指定的文件總是處理。
+    """
+    file_paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                for file in sorted(files):
+                    if file.lower().endswith(IMAGE_EXTENSIONS) and not is_output_name(file, skip_suffixes):
+                        file_paths.append(os.path.join(root, file))
+        elif not glob.has_magic(pattern):
+            if os.path.isfile(pattern) and pattern.lower().endswith(IMAGE_EXTENSIONS):
+                file_paths.append(pattern)
+        else:
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if path.lower().endswith(IMAGE_EXTENSIONS) and not is_output_name(path, skip_suffixes):
+                    file_paths.append(path)
+    return file_paths
+
+
+def parse_rgb(text):
+    values = tuple(int(v) for v in text.split(','))
+    if len(values) != 3 or not all(0 <= v <= 255 for v in values):
+        raise argparse.ArgumentTypeError("顏色格式應為 r,g,b（0-255）")
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="圖片濾鏡批量處理")
+    parser.add_argument("inputs", nargs="+", help="圖片文件、文件夾或通配符")
+    parser.add_argument("-c", "--color", choices=COLOR_NAMES, default="red", help="濾鏡顏色")
+    parser.add_argument("-i", "--intensity", type=int, default=50, help="濾鏡強度 0-100")
+    parser.add_argument("--gray", action="store_true", help="灰度模式（添加_gray後綴）")
+    parser.add_argument("--bg", type=parse_rgb, default=(255, 255, 255), help="灰度模式下的背景顏色 r,g,b")
+    parser.add_argument("--threshold", type=int, default=30, help="背景顏色閾值 0-100")
+    parser.add_argument("--variants",
+                        help="一次輸出多個版本，如 red,blue,gray（共用 -i、--bg、--threshold）")
+    parser.add_argument("--chain", help="濾鏡鏈JSON文件，指定後忽略上面的濾鏡選項")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="並行進程數（默認為CPU核心數）")
+    parser.add_argument("--strip-mb", type=int, default=None,
+                        help="按水平條帶處理，每個條帶的工作內存上限（MB），用於超大圖片")
+    parser.add_argument("--check-proxy", action="store_true",
+                        help="不保存，只檢查代理預覽與全分辨率結果縮小後的像素差異")
+    args = parser.parse_args(argv)
+
+    if args.variants:
+        try:
+            params = variant_params(args.variants.split(","), args.intensity / 100.0, args.bg, args.threshold)
+        except ValueError as e:
+            print(f"錯誤：{e}")
+            return 1
+    elif args.chain:
+        try:
+            params = FilterChain.load(args.chain)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"錯誤：無法載入濾鏡鏈 {args.chain}: {e}")
+            return 1
+    else:
+        params = FilterParams(
+            color=args.color,
+            intensity=args.intensity / 100.0,
+            gray_mode=args.gray,
+            background_color=args.bg,
+            bg_threshold=args.threshold
+        )
+
+    # 濾鏡鏈的輸出使用自定義後綴，也要跳過
+    skip_suffixes = OUTPUT_SUFFIXES + ((params.suffix,) if isinstance(params, FilterChain) else ())
+    file_paths = collect_images(args.inputs, skip_suffixes)
+    if not file_paths:
+        print("錯誤：找不到任何圖片！")
+        return 1
+
+    if args.check_proxy:
+        # --variants 時逐個版本檢查，按輸出後綴標明是哪個版本
+        variants = params if isinstance(params, list) else [params]
+        for file_path in file_paths:
+            with Image.open(file_path) as img:
+                for variant in variants:
+                    max_diff, mean_diff = proxy_difference(img, variant)
+                    label = f" ({variant.suffix})" if len(variants) > 1 else ""
+                    print(f"{file_path}{label}: 最大差異 {max_diff}，平均差異 {mean_diff:.3f}")
+        return 0
+
+    def report(done, total, file_path, error):
+        if error:
+            print(f"[{done}/{total}] 處理圖片 {file_path} 時發生錯誤: {error}")
+        else:
+            print(f"[{done}/{total}] {file_path}")
+
+    try:
+        strip_bytes = args.strip_mb * 1024 * 1024 if args.strip_mb else None
+        result = run_batch(file_paths, params, jobs=args.jobs, progress=report, strip_bytes=strip_bytes)
+    except KeyboardInterrupt:
+        print("已取消")
+        return 130
+
+    print(f"\n已處理並保存 {len(result.saved)} 張圖片，失敗 {len(result.errors)} 張")
+    return 1 if result.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+圖片濾鏡工具性能測試
+
+    python color_filter_bench.py qimage     # PIL -> QImage -> QPixmap 每幀的拷貝次數與耗時
+    python color_filter_bench.py strips     # 整圖與條帶處理的峰值內存
+
+無顯示器的環境可設置 QT_QPA_PLATFORM=offscreen 運行。
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+import shared_path  # 使 shared 文件夾中的模塊可以導入
+from image_memory import peak_rss_kb
+
+
+def make_frame(width, height, mode):
+    """生成帶漸變和半透明區域的測試圖片（全程uint8，大尺寸也不會佔用過多內存）"""
+    x = np.arange(width)
+    y = np.arange(height)
+    red = (x * 255 // max(width - 1, 1)).astype(np.uint8)[None, :]
+    green = (y * 255 // max(height - 1, 1)).astype(np.uint8)[:, None]
+    # uint8 相加自然對256取模
+    blue = x.astype(np.uint8)[None, :] + y.astype(np.uint8)[:, None]
+    checker = ((x // 16).astype(np.uint8)[None, :] + (y // 16).astype(np.uint8)[:, None]) % 2
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[:, :, 0] = red
+    pixels[:, :, 1] = green
+    pixels[:, :, 2] = blue
+    pixels[:, :, 3] = np.where(checker == 0, 255, 96)
+    return Image.fromarray(pixels).convert(mode)
+
+
+def _address(obj):
+    """像素內存的地址，用於判斷相鄰兩步之間是否發生拷貝"""
+    from PyQt6.QtGui import QImage, QPixmap
+    if isinstance(obj, bytes):
+        return np.frombuffer(obj, dtype=np.uint8).ctypes.data
+    if isinstance(obj, QImage):
+        return int(obj.constBits())
+    if isinstance(obj, QPixmap):
+        return int(obj.toImage().constBits())
+    return None
+
+
+def run_stages(stages, frame, rounds):
+    """
+    逐步運行轉換流程
+
+    每一步只保留輸出，上一步的中間結果立即釋放：輸出若仍引用已釋放的內存，
+    共享像素的"零拷貝"就不成立，最後的 check_output 會發現（或直接崩潰）。
+
+    Returns:
+        tuple: (每一步的 (名稱, 所在線程, 拷貝次數, 毫秒) 列表, 最後一步的輸出)
+    """
+    report = []
+    value = frame
+    for name, thread, stage in stages:
+        pil_before = Image.core.get_stats()["new_count"]
+        output = stage(value)
+        copies = Image.core.get_stats()["new_count"] - pil_before
+        if isinstance(value, Image.Image):
+            # PIL的像素無法被外部共享，轉成其他對象必然複製一次
+            copies += 0 if isinstance(output, Image.Image) else 1
+        elif _address(output) != _address(value):
+            copies += 1
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            stage(value)
+        elapsed = (time.perf_counter() - start) / rounds * 1000
+        report.append((name, thread, copies, elapsed))
+        value = output
+        del output
+        gc.collect()
+    return report, value
+
+
+def check_output(pixmap, frame):
+    """比較最後得到的 QPixmap 與原圖，中間結果都已釋放，像素必須仍然有效"""
+    from PyQt6.QtGui import QImage
+    rgba = frame.convert("RGBA")
+    data = rgba.tobytes("raw", "RGBA")
+    expected = QImage(data, rgba.width, rgba.height, rgba.width * 4, QImage.Format.Format_RGBA8888)
+    expected = expected.convertToFormat(QImage.Format.Format_ARGB32_Premultiplied)
+    return pixmap.toImage().convertToFormat(QImage.Format.Format_ARGB32_Premultiplied) == expected
+
+
+def legacy_stages(width, height):
+    # 原來的轉換方式：全部在介面線程中完成
+    from PyQt6.QtGui import QImage, QPixmap
+
+    def wrap(data):
+        qimg = QImage(data, width, height, width * 4, QImage.Format.Format_RGBA8888)
+        # 原代碼在同一個函數中立即轉為 QPixmap，期間 data 一直是局部變量
+        qimg._buffer = data
+        return qimg
+
+    return [
+        ("convert", "介面", lambda img: img.convert("RGBA")),
+        ("tobytes", "介面", lambda img: img.tobytes("raw", "RGBA")),
+        ("QImage", "介面", wrap),
+        ("QPixmap.fromImage", "介面", QPixmap.fromImage),
+    ]
+
+
+def bridge_stages():
+    from PyQt6.QtGui import QPixmap
+    from qimage_bridge import pil_to_qimage, to_display_format
+    return [
+        ("pil_to_qimage", "工作", pil_to_qimage),
+        ("to_display_format", "工作", to_display_format),
+        ("QPixmap.fromImage", "介面", QPixmap.fromImage),
+    ]
+
+
+def bench_qimage(args):
+    from PyQt6.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    frame = make_frame(args.width, args.height, args.mode)
+    print(f"{args.mode} {args.width}x{args.height}，每幀的像素拷貝：")
+    for name, stages in (("原方式", legacy_stages(args.width, args.height)), ("qimage_bridge", bridge_stages())):
+        report, pixmap = run_stages(stages, frame, args.rounds)
+        total_copies = sum(copies for _, _, copies, _ in report)
+        ui_copies = sum(copies for _, thread, copies, _ in report if thread == "介面")
+        ui_ms = sum(ms for _, thread, _, ms in report if thread == "介面")
+        total_ms = sum(ms for _, _, _, ms in report)
+        print(f"  {name}：共 {total_copies} 次（介面線程 {ui_copies} 次），"
+              f"介面線程 {ui_ms:.3f} ms/幀，總計 {total_ms:.3f} ms/幀，"
+              f"結果{'一致' if check_output(pixmap, frame) else '不一致'}")
+        for stage_name, thread, copies, ms in report:
+            print(f"    {stage_name:20s} {thread}線程  拷貝 {copies}  {ms:.3f} ms")
+    return app
+
+
+def strips_worker(args):
+    # 在子進程中運行，輸出峰值RSS（KB）和結果的摘要
+    import hashlib
+    from color_filter_engine import FilterParams, apply_filter, apply_filter_strips
+
+    params = FilterParams(gray_mode=args.gray)
+    with Image.open(args.path) as img:
+        if args.mode == "full":
+            result = apply_filter(img, params)
+        elif args.mode == "strips":
+            result = apply_filter_strips(img, params, args.strip_mb * 1024 * 1024, in_place=True)
+        else:
+            result = None
+        peak = peak_rss_kb()
+        digest = hashlib.md5(result.tobytes()).hexdigest() if result else ""
+    print(peak, digest)
+
+
+def bench_strips(args):
+    """對比整圖與條帶處理的峰值內存，並確認兩者結果一致（僅限Unix）"""
+    import os
+    import subprocess
+    import tempfile
+
+    def run_worker(mode, path):
+        command = [sys.executable, os.path.abspath(__file__), "strips-worker", mode, path,
+                   "--strip-mb", str(args.strip_mb)]
+        if args.gray:
+            command.append("--gray")
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout.split()
+        return int(output[0]) / 1024, output[1] if len(output) > 1 else ""
+
+    print(f"{'灰度' if args.gray else '濾鏡'}模式，條帶預算 {args.strip_mb} MB，寬度 {args.width}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for height in args.heights:
+            path = os.path.join(tmp, f"strips_{height}.png")
+            make_frame(args.width, height, "RGBA").save(path, compress_level=1)
+            baseline, _ = run_worker("none", path)
+            full_peak, full_digest = run_worker("full", path)
+            strips_peak, strips_digest = run_worker("strips", path)
+            decoded = args.width * height * 4 / 1024 / 1024
+            print(f"  高度 {height}（解碼後 {decoded:.0f} MB）：整圖 +{full_peak - baseline:.0f} MB，"
+                  f"條帶 +{strips_peak - baseline:.0f} MB，結果{'一致' if full_digest == strips_digest else '不一致'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="圖片濾鏡工具性能測試")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    qimage_parser = subparsers.add_parser("qimage", help="PIL -> QImage -> QPixmap 轉換")
+    qimage_parser.add_argument("--width", type=int, default=500)
+    qimage_parser.add_argument("--height", type=int, default=300)
+    qimage_parser.add_argument("--rounds", type=int, default=200)
+    qimage_parser.add_argument("--mode", choices=("RGBA", "RGB"), default="RGBA")
+    qimage_parser.set_defaults(func=bench_qimage)
+
+    strips_parser = subparsers.add_parser("strips", help="整圖與條帶處理的峰值內存")
+    strips_parser.add_argument("--width", type=int, default=4096)
+    strips_parser.add_argument("--heights", type=lambda text: [int(v) for v in text.split(",")],
+                               default=[2048, 8192])
+    strips_parser.add_argument("--strip-mb", type=int, default=16)
+    strips_parser.add_argument("--gray", action="store_true", help="測試灰度模式")
+    strips_parser.set_defaults(func=bench_strips)
+
+    worker_parser = subparsers.add_parser("strips-worker")
+    worker_parser.add_argument("mode", choices=["none", "full", "strips"])
+    worker_parser.add_argument("path")
+    worker_parser.add_argument("--strip-mb", type=int, default=16)
+    worker_parser.add_argument("--gray", action="store_true")
+    worker_parser.set_defaults(func=strips_worker)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
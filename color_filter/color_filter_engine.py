@@ -0,0 +1,491 @@
+"""
+圖片濾鏡引擎
+
+不依賴 Qt 的濾鏡核心，供 color_filter_tool.py（圖形介面）與
+color_filter_batch.py（批量處理 / 命令列）共用。
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+from PIL import GifImagePlugin, Image, ImageSequence
+
+# 濾鏡顏色RGB值（順序與介面下拉選單一致）
+COLOR_MAP = {
+    "red": (255, 0, 0),
+    "green": (0, 255, 0),
+    "blue": (0, 0, 255),
+    "yellow": (255, 255, 0),
+    "purple": (128, 0, 128),
+    "cyan": (0, 255, 255),
+    "orange": (255, 165, 0),
+    "brown": (165, 42, 42),
+    "pink": (255, 192, 203)
+}
+COLOR_NAMES = list(COLOR_MAP)
+# 單色和灰度版本的輸出文件名後綴，掃描文件夾時據此跳過之前的輸出
+OUTPUT_SUFFIXES = tuple(f"_{name}" for name in COLOR_NAMES) + ("_gray",)
+
+# 預覽區域尺寸
+PREVIEW_SIZE = (500, 300)
+
+# 解碼後超過此大小的圖片在保存時自動按條帶處理
+LARGE_IMAGE_BYTES = 256 * 1024 * 1024
+# 條帶處理的工作內存預算
+DEFAULT_STRIP_BYTES = 16 * 1024 * 1024
+# 動畫去重時每個輸出保留的已處理幀數
+ANIMATION_FRAME_CACHE = 8
+# 灰度模式每個像素的工作內存上限估計（像素、整數通道、浮點灰度、距離、輸出）
+_GRAY_BYTES_PER_PIXEL = 48
+
+
+@dataclass(frozen=True)
+class FilterParams:
+    """一次濾鏡處理所需的全部參數（可雜湊、可跨進程傳遞）"""
+    color: str = "red"
+    intensity: float = 0.5
+    gray_mode: bool = False
+    background_color: tuple = (255, 255, 255)
+    bg_threshold: int = 30
+
+    @property
+    def suffix(self):
+        """輸出文件名後綴"""
+        return "_gray" if self.gray_mode else f"_{self.color}"
+
+
+def variant_params(names, intensity=0.5, background_color=(255, 255, 255), bg_threshold=30):
+    """
+    按版本名稱生成一組濾鏡參數
+
+    Args:
+        names (list): 顏色名稱，"gray" 表示灰度版本
+    """
+    variants = []
+    for name in names:
+        if name == "gray":
+            variants.append(FilterParams(gray_mode=True, background_color=tuple(background_color),
+                                         bg_threshold=bg_threshold))
+        elif name in COLOR_MAP:
+            variants.append(FilterParams(color=name, intensity=intensity))
+        else:
+            raise ValueError(f"未知的顏色: {name}")
+    return variants
+
+
+class BackgroundPlanes:
+    """
+    灰度模式的預計算平面，同一張圖片只計算一次（不保存像素本身）
+
+    luminance: 0.299/0.587/0.114 加權的灰度值（uint8）
+    distance: 與背景顏色的曼哈頓距離（int16，不會溢出）；
+              半透明像素（Alpha小於128）記為-1，任何閾值下都屬於背景
+
+    use_alpha 為None時按本圖是否含有透明像素決定是否按透明度判斷背景；
+    按條帶處理時由整張圖片決定後傳入，保證與整圖處理結果一致。
+    由 image_store.ImageStore 與圖片一起緩存並計入字節預算。
+    """
+
+    def __init__(self, use_alpha=None):
+        self.use_alpha = use_alpha
+        self.luminance = None
+        self.transparent = None
+        self.background_color = None
+        self.distance = None
+        # 預覽線程與介面線程可能同時對同一張圖片計算
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return sum(plane.nbytes for plane in (self.luminance, self.transparent, self.distance) if plane is not None)
+
+    def compute(self, pixels, background_color):
+        """
+        返回 (luminance, distance)，只在第一次或背景顏色改變時計算
+
+        Args:
+            pixels (numpy.ndarray): 同一張圖片的RGB或RGBA像素（只讀取）
+            background_color (tuple): 背景顏色 (r, g, b)
+        """
+        with self.lock:
+            rgb = pixels[:, :, :3]
+            if self.luminance is None:
+                self.luminance = (0.299 * rgb[:, :, 0] + 0.587 * rgb[:, :, 1]
+                                  + 0.114 * rgb[:, :, 2]).astype(np.uint8)
+                if pixels.shape[2] == 4:
+                    alpha_channel = pixels[:, :, 3]
+                    # 只有圖片含有透明像素時才按透明度判斷背景
+                    use_alpha = self.use_alpha
+                    if use_alpha is None:
+                        use_alpha = np.any(alpha_channel < 255)
+                    if use_alpha:
+                        self.transparent = alpha_channel < 128
+            if background_color != self.background_color:
+                distance = np.abs(rgb.astype(np.int16) - np.array(background_color, dtype=np.int16)).sum(
+                    axis=2, dtype=np.int16)
+                if self.transparent is not None:
+                    distance[self.transparent] = -1
+                self.distance = distance
+                self.background_color = background_color
+            return self.luminance, self.distance
+
+
+def gray_pixels(img):
+    """灰度模式的輸入像素（可寫的新數組），非RGB/RGBA圖片先轉為RGB"""
+    if img.mode != "RGBA" and img.mode != "RGB":
+        img = img.convert("RGB")
+    return np.array(img)
+
+
+def apply_gray(img, background_color, threshold, planes=None):
+    """
+    將非背景部分轉換為灰度
+
+    傳入同一張圖片的 planes 時，灰度值和背景距離只計算一次，
+    調整閾值時只需一次比較加一次帶遮罩的寫入。
+
+    Args:
+        img (PIL.Image): 原始圖片
+        background_color (tuple): 背景顏色 (r, g, b)
+        threshold (int): 背景顏色閾值
+        planes (BackgroundPlanes): 這張圖片的預計算平面，為None時臨時計算
+    """
+    pixels = gray_pixels(img)
+    if planes is None:
+        planes = BackgroundPlanes()
+    luminance, distance = planes.compute(pixels, tuple(background_color))
+    return gray_from_planes(pixels, luminance, distance, threshold)
+
+
+def gray_from_planes(pixels, luminance, distance, threshold):
+    # 距離不小於閾值的是前景（半透明像素距離為-1，總是背景）；直接寫入 pixels 作為輸出
+    foreground = distance >= threshold * 3
+    np.copyto(pixels[:, :, :3], luminance[:, :, None], where=foreground[:, :, None])
+    return Image.fromarray(pixels)
+
+
+@lru_cache(maxsize=512)
+def tint_lut(rgb, intensity, with_alpha=False):
+    """
+    生成濾鏡的逐通道查找表，按 (顏色, 強度, 是否含Alpha) 緩存
+
+    濾鏡是逐通道的仿射映射 c*(1-k) + color*k，只取決於8位輸入值，
+    因此每個通道只需計算256項，之後處理任何尺寸的圖片都只需查表。
+
+    Returns:
+        tuple: R、G、B（及恆等的A）各256項，可直接用於 Image.point
+    """
+    levels = np.arange(256, dtype=np.float64)
+    lut = []
+    for channel_value in rgb:
+        # 與逐像素計算完全一致：浮點結果截斷為uint8
+        lut.extend((levels * (1 - intensity) + channel_value * intensity).astype(np.uint8).tolist())
+    if with_alpha:
+        # Alpha通道使用恆等表保持不變
+        lut.extend(range(256))
+    return tuple(lut)
+
+
+def apply_tint(img, color, intensity):
+    """
+    為圖片疊加顏色濾鏡，RGBA圖片保留Alpha通道
+
+    Args:
+        img (PIL.Image): 原始圖片
+        color (str): 濾鏡顏色名稱（COLOR_MAP 的鍵）
+        intensity (float): 濾鏡強度 0.0-1.0
+    """
+    rgb = COLOR_MAP[color]
+
+    if img.mode == "RGBA":
+        return img.point(tint_lut(rgb, intensity, with_alpha=True))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img.point(tint_lut(rgb, intensity))
+
+
+def palette_alpha(img):
+    """返回索引色圖片每個調色板項的Alpha（uint8數組），沒有透明度時返回None"""
+    transparency = img.info.get("transparency")
+    if transparency is None:
+        return None
+    alpha = np.full(len(img.getpalette("RGB")) // 3, 255, dtype=np.uint8)
+    if isinstance(transparency, int):
+        if transparency < len(alpha):
+            alpha[transparency] = 0
+    else:
+        count = min(len(transparency), len(alpha))
+        alpha[:count] = np.frombuffer(bytes(transparency), dtype=np.uint8)[:count]
+    return alpha
+
+
+def can_filter_palette(img):
+    """是否可以只處理調色板（P模式且調色板為RGB）"""
+    return img.mode == "P" and img.palette is not None and img.palette.mode == "RGB"
+
+
+def apply_palette(img, params):
+    """
+    只對調色板應用濾鏡，像素索引和透明度保持不變
+
+    濾鏡和灰度都只取決於每個像素的顏色，對最多256項的調色板計算後
+    結果與逐像素計算完全一致，輸出仍是體積小的索引色圖片。
+
+    Args:
+        img (PIL.Image): P模式圖片（can_filter_palette 為真）
+        params (FilterParams): 濾鏡參數
+    """
+    palette = np.array(img.getpalette("RGB"), dtype=np.uint8).reshape(-1, 3)
+    if params.gray_mode:
+        luminance = (0.299 * palette[:, 0] + 0.587 * palette[:, 1] + 0.114 * palette[:, 2]).astype(np.uint8)
+        distance = np.abs(palette.astype(np.int16) - np.array(params.background_color, dtype=np.int16)).sum(axis=1)
+        foreground = distance >= params.bg_threshold * 3
+        alpha = palette_alpha(img)
+        if alpha is not None:
+            # 與RGBA圖片相同，半透明（Alpha小於128）的顏色屬於背景
+            foreground &= alpha >= 128
+        new_palette = palette.copy()
+        new_palette[foreground] = luminance[foreground, None]
+    else:
+        lut = np.array(tint_lut(COLOR_MAP[params.color], params.intensity), dtype=np.uint8).reshape(3, 256)
+        new_palette = lut[np.arange(3), palette]
+
+    # copy 保留 info 中的透明度
+    result = img.copy()
+    result.putpalette(new_palette.tobytes(), "RGB")
+    return result
+
+
+def apply_filter(img, params, planes=None):
+    """
+    按參數對單張圖片應用濾鏡，返回新的圖片
+
+    params 也可以是濾鏡鏈（filter_chain.FilterChain），此時由濾鏡鏈自己處理。
+    索引色圖片只處理調色板，結果仍為索引色。
+    planes 為這張圖片的 BackgroundPlanes，灰度計算的結果保存在其中供下次使用。
+    """
+    if not isinstance(params, FilterParams):
+        return params.apply(img, planes)
+    if can_filter_palette(img):
+        return apply_palette(img, params)
+    if params.gray_mode:
+        return apply_gray(img, params.background_color, params.bg_threshold, planes)
+    return apply_tint(img, params.color, params.intensity)
+
+
+def decoded_nbytes(size, mode):
+    """按尺寸和模式估算解碼後的字節數"""
+    return size[0] * size[1] * Image.getmodebands(mode)
+
+
+def apply_filter_strips(img, params, strip_bytes=DEFAULT_STRIP_BYTES, in_place=False):
+    """
+    按水平條帶處理圖片，結果與 apply_filter 完全一致
+
+    每個條帶的工作內存不超過 strip_bytes，與圖片高度無關；
+    除原圖外只需要一張輸出圖片，in_place 為真且原圖已是RGB/RGBA時
+    直接寫回原圖，連輸出圖片也省去。
+
+    Args:
+        img (PIL.Image): 原始圖片
+        params (FilterParams): 濾鏡參數
+        strip_bytes (int): 每個條帶的工作內存預算
+        in_place (bool): 是否允許修改原圖
+    """
+    width, height = img.size
+    out_mode = "RGBA" if img.mode == "RGBA" else "RGB"
+    rows = max(1, strip_bytes // (width * _GRAY_BYTES_PER_PIXEL))
+
+    use_alpha = None
+    if params.gray_mode and img.mode == "RGBA":
+        # 是否按透明度判斷背景取決於整張圖片，不能每個條帶各自決定
+        use_alpha = img.getextrema()[3][0] < 255
+
+    output = img if in_place and img.mode == out_mode else Image.new(out_mode, img.size)
+    for top in range(0, height, rows):
+        box = (0, top, width, min(top + rows, height))
+        strip = img.crop(box)
+        if params.gray_mode:
+            pixels = gray_pixels(strip)
+            luminance, distance = BackgroundPlanes(use_alpha).compute(pixels, tuple(params.background_color))
+            result = gray_from_planes(pixels, luminance, distance, params.bg_threshold)
+        else:
+            result = apply_tint(strip, params.color, params.intensity)
+        output.paste(result, box)
+    return output
+
+
+def make_proxy(img, size=PREVIEW_SIZE):
+    """
+    生成顯示尺寸的代理圖片，供預覽時代替全分辨率原圖進行濾鏡計算
+
+    濾鏡本身會把非RGB/RGBA圖片轉為RGB，這裡提前轉換，
+    使代理圖片與原圖經過濾鏡後的模式一致；帶透明度的索引色圖片
+    轉為RGBA，與只處理調色板的結果一致。
+    """
+    if img.mode == "P" and "transparency" in img.info:
+        img = img.convert("RGBA")
+    elif img.mode != "RGBA" and img.mode != "RGB":
+        img = img.convert("RGB")
+    proxy = img.copy()
+    proxy.thumbnail(size)
+    return proxy
+
+
+def proxy_difference(img, params, size=PREVIEW_SIZE):
+    """
+    檢查代理預覽與全分辨率結果縮小後是否一致
+
+    Returns:
+        tuple: (最大差異, 平均差異)，以0-255的像素值計
+    """
+    preview = np.asarray(apply_filter(make_proxy(img, size), params), dtype=np.int32)
+    full = np.asarray(make_proxy(apply_filter(img, params), size), dtype=np.int32)
+    if preview.shape[-1] == 4:
+        # 縮放時透明像素的RGB沒有意義，按預乘Alpha比較可見的顏色
+        preview[..., :3] = preview[..., :3] * preview[..., 3:] // 255
+        full[..., :3] = full[..., :3] * full[..., 3:] // 255
+    diff = np.abs(preview - full)
+    return int(diff.max()), float(diff.mean())
+
+
+def output_path(file_path, params):
+    """處理後的圖片保存在原目錄，文件名為"原文件名_顏色.擴展名" """
+    image_dir = os.path.dirname(file_path)
+    image_name_without_ext, image_ext = os.path.splitext(os.path.basename(file_path))
+    return os.path.join(image_dir, f"{image_name_without_ext}{params.suffix}{image_ext}")
+
+
+def is_animated_gif(img):
+    return img.format == "GIF" and getattr(img, "is_animated", False)
+
+
+def _gif_frame(img):
+    """
+    將濾鏡結果轉為GIF可寫入的P模式幀
+
+    Returns:
+        tuple: (P模式圖片, 透明色索引或None)
+    """
+    if img.mode == "P":
+        transparency = img.info.get("transparency")
+        return img, transparency if isinstance(transparency, int) else None
+    if img.mode == "RGBA":
+        # 保留255個顏色，第256個作為透明色
+        frame = img.convert("RGB").quantize(255)
+        palette = frame.getpalette("RGB")
+        frame.putpalette(palette + [0] * (768 - len(palette)), "RGB")
+        frame.paste(255, mask=img.getchannel("A").point(lambda a: 255 if a < 128 else 0))
+        return frame, 255
+    return img.convert("RGB").quantize(256), None
+
+
+def _frame_digest(frame):
+    digest = hashlib.blake2b(frame.mode.encode(), digest_size=16)
+    digest.update(frame.tobytes())
+    if frame.mode == "P":
+        digest.update(bytes(frame.getpalette("RGB")))
+        digest.update(repr(frame.info.get("transparency")).encode())
+    return digest.digest()
+
+
+def save_animation(img, targets):
+    """
+    逐幀處理動畫GIF，同時寫出一個或多個結果，返回保存路徑列表
+
+    每次只解碼一幀，處理後立即寫入文件，保留每幀的時長和處置方式；
+    內容相同的幀只處理一次（按雜湊值查找最近處理過的幀），
+    內存中最多保留 ANIMATION_FRAME_CACHE 個已處理的幀。
+
+    Args:
+        img (PIL.Image): 動畫GIF
+        targets (list): (濾鏡參數, 保存路徑) 的列表
+    """
+    files = [open(save_path, "wb") for _, save_path in targets]
+    caches = [OrderedDict() for _ in targets]
+    loop = img.info.get("loop")
+    try:
+        for index, frame in enumerate(ImageSequence.Iterator(img)):
+            digest = _frame_digest(frame)
+            options = {"duration": frame.info.get("duration", 0),
+                       "disposal": getattr(img, "disposal_method", 0)}
+            for (params, _), fp, cache in zip(targets, files, caches):
+                if digest in cache:
+                    cache.move_to_end(digest)
+                    output, transparency = cache[digest]
+                else:
+                    output, transparency = _gif_frame(apply_filter(frame, params))
+                    cache[digest] = (output, transparency)
+                    if len(cache) > ANIMATION_FRAME_CACHE:
+                        cache.popitem(last=False)
+                if index == 0:
+                    info = {"background": img.info.get("background", 0)}
+                    if loop is not None:
+                        info["loop"] = loop
+                    # getheader 可能修改傳入的圖片
+                    header, _ = GifImagePlugin.getheader(output.copy(), info=info)
+                    fp.write(b"".join(header))
+                frame_options = dict(options, include_color_table=True)
+                if transparency is not None:
+                    frame_options["transparency"] = transparency
+                for chunk in GifImagePlugin.getdata(output, (0, 0), **frame_options):
+                    fp.write(chunk)
+        for fp in files:
+            fp.write(b";")
+    finally:
+        for fp in files:
+            fp.close()
+    return [save_path for _, save_path in targets]
+
+
+def process_file(file_path, params, strip_bytes=None):
+    """
+    載入、處理並保存單張圖片，返回保存路徑
+
+    strip_bytes 不為空時按條帶處理；為空時超大圖片自動使用條帶處理。
+    動畫GIF逐幀處理，保留動畫。
+    """
+    with Image.open(file_path) as img:
+        if is_animated_gif(img):
+            return save_animation(img, [(params, output_path(file_path, params))])[0]
+        if strip_bytes is None and decoded_nbytes(img.size, img.mode) > LARGE_IMAGE_BYTES:
+            strip_bytes = DEFAULT_STRIP_BYTES
+        # 濾鏡鏈含有需要整圖信息的步驟，只有單一濾鏡支持條帶處理；
+        # 索引色圖片只處理調色板，不需要條帶
+        if strip_bytes and isinstance(params, FilterParams) and not can_filter_palette(img):
+            # 圖片是剛從文件解碼的，可以直接寫回
+            result = apply_filter_strips(img, params, strip_bytes, in_place=True)
+        else:
+            result = apply_filter(img, params)
+    save_path = output_path(file_path, params)
+    result.save(save_path)
+    return save_path
+
+
+def _render_and_save(img, params, save_path, planes):
+    apply_filter(img, params, planes).save(save_path)
+    return save_path
+
+
+def process_file_variants(file_path, variants, threads=4):
+    """
+    只解碼一次，生成並保存多個版本（如 _red、_blue、_gray），返回保存路徑列表
+
+    所有版本共用同一張解碼後的原圖：顏色濾鏡各自只需一次查表，
+    灰度版本的預計算平面也只算一次；各版本的計算和編碼在線程中並行，
+    同時在內存中的結果不超過線程數。動畫GIF逐幀處理，每幀只解碼一次。
+    """
+    with Image.open(file_path) as img:
+        if is_animated_gif(img):
+            return save_animation(img, [(params, output_path(file_path, params)) for params in variants])
+        img.load()
+        planes = BackgroundPlanes()
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(variants)))) as executor:
+            futures = [executor.submit(_render_and_save, img, params, output_path(file_path, params), planes)
+                       for params in variants]
+            return [future.result() for future in futures]
@@ -3,11 +3,88 @@ import os
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QLabel, QPushButton, 
                             QVBoxLayout, QHBoxLayout, QWidget, QFileDialog, 
                             QComboBox, QSlider, QGroupBox, QListWidget, 
-                            QCheckBox, QMessageBox, QColorDialog)
-from PyQt6.QtGui import QPixmap, QImage, QColor
-from PyQt6.QtCore import Qt
-from PIL import Image, ImageEnhance, ImageOps
-import numpy as np
+                            QCheckBox, QMessageBox, QColorDialog, QProgressDialog,
+                            QListWidgetItem)
+from PyQt6.QtGui import QPixmap, QColor
+from PyQt6.QtCore import Qt, QThread, QThreadPool, QRunnable, QObject, pyqtSignal
+import threading
+
+from color_filter_engine import (COLOR_NAMES, LARGE_IMAGE_BYTES, FilterParams,
+                                 decoded_nbytes, output_path, process_file, variant_params)
+from color_filter_batch import BatchResult, run_batch
+from filter_chain import FilterChain
+from image_store import ImageStore
+from qimage_bridge import display_qimage
+
+
+class BatchThread(QThread):
+    """在背景線程中運行多進程批量處理，通過信號回報進度"""
+    progress = pyqtSignal(int)
+    finished_with_result = pyqtSignal(object)
+    
+    def __init__(self, file_paths, params, parent=None):
+        super().__init__(parent)
+        self.file_paths = list(file_paths)
+        self.params = params
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def run(self):
+        try:
+            result = run_batch(
+                self.file_paths, self.params,
+                progress=lambda done, total, path, error: self.progress.emit(done),
+                cancel_event=self.cancel_event
+            )
+        except Exception as e:
+            # 無論如何都要回報結果，介面才能關閉進度窗口
+            result = BatchResult(len(self.file_paths))
+            result.errors = [(path, f"批量處理失敗: {e}") for path in self.file_paths]
+        self.finished_with_result.emit(result)
+
+
+class PreviewSignals(QObject):
+    # 世代號, 原圖QImage, 濾鏡QImage
+    ready = pyqtSignal(int, object, object)
+
+
+class PreviewJob(QRunnable):
+    """
+    在線程池中渲染一次預覽
+
+    只生成QImage，QPixmap必須在介面線程中創建。
+    is_stale() 為真時說明已有更新的參數，提前放棄本次渲染。
+    """
+    
+    def __init__(self, generation, store, index, params, is_stale, signals):
+        super().__init__()
+        self.generation = generation
+        self.store = store
+        self.index = index
+        self.params = params
+        self.is_stale = is_stale
+        self.signals = signals
+    
+    def run(self):
+        original_qimg = filtered_qimg = None
+        try:
+            # 代理圖片由存儲按需解碼生成並緩存
+            proxy = self.store.proxy(self.index)
+            if not self.is_stale():
+                # 灰度平面與代理圖片一起緩存在存儲中，調整閾值時不必重算
+                filtered = self.store.filtered_proxy(self.index, self.params)
+                original_qimg = display_qimage(proxy)
+                filtered_qimg = display_qimage(filtered)
+        except Exception as e:
+            # 文件損壞、被刪除或無法讀取
+            print(f"無法預覽圖片: {e}")
+            original_qimg = filtered_qimg = None
+        finally:
+            # 無論成功與否都要回報，介面才能開始下一次渲染
+            self.signals.ready.emit(self.generation, original_qimg, filtered_qimg)
+
 
 class ColorFilterTool(QMainWindow):
     def __init__(self):
@@ -16,8 +93,7 @@ class ColorFilterTool(QMainWindow):
         self.setGeometry(100, 100, 1200, 700)
         
         # 初始化變數
-        self.original_images = []  # 存儲多個圖片
-        self.current_images = []   # 存儲處理後的多個圖片
+        self.store = ImageStore()  # 圖片路徑與按需解碼的緩存
         self.image_paths = []      # 存儲所有圖片路徑
         self.selected_image_index = -1  # 當前選擇的圖片索引
         self.filter_color = "red"  # 默認濾鏡顏色
@@ -25,6 +101,15 @@ class ColorFilterTool(QMainWindow):
         self.gray_mode = False     # 灰度模式
         self.background_color = (255, 255, 255)  # 默認背景顏色（白色）
         self.bg_threshold = 30     # 背景顏色閾值
+        self.filter_chain = None   # 載入的濾鏡鏈
+        
+        # 背景預覽：同一時間只渲染一個任務，期間的參數變化只保留最新一次
+        self.preview_pool = QThreadPool(self)
+        self.preview_signals = PreviewSignals()
+        self.preview_signals.ready.connect(self.on_preview_ready)
+        self.preview_generation = 0   # 每次參數變化加一
+        self.preview_running = False  # 是否有渲染任務在途
+        self.pending_preview = None   # 在途期間最新的預覽請求
         
         # 創建UI
         self.init_ui()
@@ -112,6 +197,39 @@ class ColorFilterTool(QMainWindow):
         intensity_group.setLayout(intensity_layout)
         left_panel.addWidget(intensity_group)
         
+        # 濾鏡鏈
+        chain_group = QGroupBox("濾鏡鏈")
+        chain_layout = QVBoxLayout()
+        self.load_chain_btn = QPushButton("載入濾鏡鏈 (JSON)")
+        self.load_chain_btn.clicked.connect(self.load_filter_chain)
+        chain_layout.addWidget(self.load_chain_btn)
+        self.chain_checkbox = QCheckBox("使用濾鏡鏈（忽略上面的設置）")
+        self.chain_checkbox.setEnabled(False)  # 初始禁用，直到載入了濾鏡鏈
+        self.chain_checkbox.stateChanged.connect(self.update_filter)
+        chain_layout.addWidget(self.chain_checkbox)
+        chain_group.setLayout(chain_layout)
+        left_panel.addWidget(chain_group)
+        
+        # 多色匯出：每張圖片只解碼一次，輸出所有勾選的版本
+        variants_group = QGroupBox("多色匯出")
+        variants_layout = QVBoxLayout()
+        self.variants_list = QListWidget()
+        labels = [self.color_combo.itemText(i) for i in range(self.color_combo.count())] + ["灰度 (Gray)"]
+        for name, label in zip(COLOR_NAMES + ["gray"], labels):
+            item = QListWidgetItem(label)
+            item.setData(Qt.ItemDataRole.UserRole, name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(Qt.CheckState.Unchecked)
+            self.variants_list.addItem(item)
+        self.variants_list.setMaximumHeight(120)
+        variants_layout.addWidget(self.variants_list)
+        self.export_variants_btn = QPushButton("匯出勾選的所有版本")
+        self.export_variants_btn.clicked.connect(self.export_variants)
+        self.export_variants_btn.setEnabled(False)  # 初始禁用，直到加載了圖片
+        variants_layout.addWidget(self.export_variants_btn)
+        variants_group.setLayout(variants_layout)
+        left_panel.addWidget(variants_group)
+        
         # 處理並保存按鈕
         self.process_all_btn = QPushButton("處理並保存所有圖片")
         self.process_all_btn.clicked.connect(self.process_and_save_all)
@@ -180,6 +298,20 @@ class ColorFilterTool(QMainWindow):
         self.bg_threshold = value
         self.update_filter()
     
+    def load_filter_chain(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "選擇濾鏡鏈", "", "濾鏡鏈 (*.json)")
+        if not file_path:
+            return
+        try:
+            self.filter_chain = FilterChain.load(file_path)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, "錯誤", f"無法載入濾鏡鏈 {file_path}: {e}")
+            return
+        self.chain_checkbox.setText(f"使用濾鏡鏈 {os.path.basename(file_path)}")
+        self.chain_checkbox.setEnabled(True)
+        self.chain_checkbox.setChecked(True)
+        self.update_filter()
+    
     def load_images(self):
         file_paths, _ = QFileDialog.getOpenFileNames(
             self, "選擇多張圖片", "", "圖片文件 (*.png *.jpg *.jpeg *.bmp *.gif)"
@@ -187,37 +319,28 @@ class ColorFilterTool(QMainWindow):
         
         if file_paths:
             # 清除現有圖片
-            self.original_images = []
-            self.current_images = []
-            self.image_paths = []
+            # 預覽線程可能仍持有舊的存儲，直接換成新的
+            self.store = ImageStore()
             self.images_list.clear()
             
-            # 加載新的圖片
+            # 只記錄路徑和元數據，需要像素時才解碼
             for file_path in file_paths:
-                # 保存路徑
-                self.image_paths.append(file_path)
-                
-                # 添加到列表
-                image_name = os.path.basename(file_path)
-                self.images_list.addItem(image_name)
-                
-                # 使用PIL打開圖片
-                try:
-                    img = Image.open(file_path)
-                    self.original_images.append(img)
-                    self.current_images.append(None)  # 先設為None，等待處理
-                except Exception as e:
-                    print(f"無法載入圖片 {file_path}: {e}")
+                if self.store.add(file_path):
+                    # 添加到列表
+                    image_name = os.path.basename(file_path)
+                    self.images_list.addItem(image_name)
+            self.image_paths = self.store.paths
             
             # 如果有圖片被載入
-            if self.original_images:
+            if self.image_paths:
                 self.process_all_btn.setEnabled(True)
+                self.export_variants_btn.setEnabled(True)
                 # 選擇第一張圖片
                 self.images_list.setCurrentRow(0)
                 self.select_image(0)
     
     def select_image(self, index):
-        if index < 0 or index >= len(self.original_images):
+        if index < 0 or index >= len(self.store):
             return
         
         self.selected_image_index = index
@@ -225,7 +348,7 @@ class ColorFilterTool(QMainWindow):
         self.save_btn.setEnabled(True)  # 啟用保存按鈕
     
     def update_filter(self):
-        if not self.original_images or self.selected_image_index < 0:
+        if not len(self.store) or self.selected_image_index < 0:
             return
         
         # 獲取當前滑桿值並更新標籤
@@ -235,204 +358,115 @@ class ColorFilterTool(QMainWindow):
         
         # 獲取選擇的濾鏡顏色
         color_index = self.color_combo.currentIndex()
-        color_name = ["red", "green", "blue", "yellow", "purple", "cyan", 
-                     "orange", "brown", "pink"][color_index]
+        color_name = COLOR_NAMES[color_index]
         self.filter_color = color_name
         
         # 獲取灰度模式狀態
         self.gray_mode = self.gray_checkbox.isChecked()
         
-        # 應用濾鏡到當前選擇的圖片
-        self.apply_filter(self.selected_image_index)
-        
-        # 更新顯示
-        self.update_display()
+        # 預覽只對顯示尺寸的代理圖片應用濾鏡，全分辨率在保存時處理
+        self.request_preview(self.selected_image_index, self.current_params())
     
-    def apply_filter(self, index):
-        if index < 0 or index >= len(self.original_images):
+    def request_preview(self, index, params):
+        self.preview_generation += 1
+        request = (self.preview_generation, index, params)
+        if self.preview_running:
+            # 合併請求：在途任務完成後只渲染最新的一次
+            self.pending_preview = request
+        else:
+            self.start_preview(request)
+    
+    def start_preview(self, request):
+        generation, index, params = request
+        if index >= len(self.store):
             return
+        self.preview_running = True
+        job = PreviewJob(generation, self.store, index, params,
+                         lambda: generation != self.preview_generation, self.preview_signals)
+        self.preview_pool.start(job)
+    
+    def on_preview_ready(self, generation, original_qimg, filtered_qimg):
+        self.preview_running = False
         
-        # 複製原始圖片
-        img = self.original_images[index].copy()
+        if self.pending_preview is not None:
+            request, self.pending_preview = self.pending_preview, None
+            self.start_preview(request)
         
-        # 先檢查是否應用灰度模式
-        if self.gray_mode:
-            # 轉換為numpy數組進行處理
-            img_array = np.array(img)
-            
-            # 根據圖片模式處理
-            if img.mode == "RGBA":
-                # 有透明通道，保留完全透明的部分不變
-                alpha_channel = img_array[:, :, 3]
-                
-                # 創建新的圖像數組，初始化為原始圖像
-                gray_array = img_array.copy()
-                
-                # 首先檢測背景像素（這裡有兩種方式：透明度或接近背景顏色）
-                is_background = np.zeros_like(alpha_channel, dtype=bool)
-                
-                # 方式1：完全透明的像素
-                if np.any(alpha_channel < 255):
-                    is_background = (alpha_channel < 128)  # 透明度小於128
-                
-                # 方式2：顏色接近背景顏色的像素
-                br, bg, bb = self.background_color
-                threshold = self.bg_threshold
-                
-                # 計算每個像素與背景顏色的差異
-                color_diff = np.abs(img_array[:, :, 0] - br) + \
-                             np.abs(img_array[:, :, 1] - bg) + \
-                             np.abs(img_array[:, :, 2] - bb)
-                
-                # 合併兩種背景檢測方法
-                is_background = is_background | (color_diff < threshold * 3)
-                
-                # 將非背景部分轉換為灰度
-                # 先計算灰度值
-                gray_values = 0.299 * img_array[:, :, 0] + 0.587 * img_array[:, :, 1] + 0.114 * img_array[:, :, 2]
-                gray_values = gray_values.astype(np.uint8)
-                
-                # 只對非背景部分應用灰度
-                for i in range(3):  # R, G, B通道
-                    gray_array[:, :, i] = np.where(is_background, img_array[:, :, i], gray_values)
-                
-                # 保存處理後的圖片
-                self.current_images[index] = Image.fromarray(gray_array)
-                
+        # 過期的結果直接丟棄；最新的渲染失敗時清空預覽，不再顯示上一張圖片
+        if generation == self.preview_generation:
+            if filtered_qimg is not None:
+                self.update_display(original_qimg, filtered_qimg)
             else:
-                # 沒有透明通道的圖片
-                if img.mode != "RGB":
-                    img = img.convert("RGB")
-                    img_array = np.array(img)
-                
-                # 檢測接近背景顏色的像素
-                br, bg, bb = self.background_color
-                threshold = self.bg_threshold
-                
-                color_diff = np.abs(img_array[:, :, 0] - br) + \
-                             np.abs(img_array[:, :, 1] - bg) + \
-                             np.abs(img_array[:, :, 2] - bb)
-                
-                is_background = (color_diff < threshold * 3)
-                
-                # 創建新的數組，初始化為原始圖像
-                gray_array = img_array.copy()
-                
-                # 計算灰度值
-                gray_values = 0.299 * img_array[:, :, 0] + 0.587 * img_array[:, :, 1] + 0.114 * img_array[:, :, 2]
-                gray_values = gray_values.astype(np.uint8)
-                
-                # 只對非背景部分應用灰度
-                for i in range(3):  # R, G, B通道
-                    gray_array[:, :, i] = np.where(is_background, img_array[:, :, i], gray_values)
-                
-                # 保存處理後的圖片
-                self.current_images[index] = Image.fromarray(gray_array)
-                
+                self.original_label.clear()
+                self.filtered_label.setText("無法預覽此圖片")
+    
+    def current_params(self):
+        """以當前介面設置生成濾鏡參數，啟用濾鏡鏈時返回濾鏡鏈"""
+        if self.filter_chain is not None and self.chain_checkbox.isChecked():
+            return self.filter_chain
+        return FilterParams(
+            color=self.filter_color,
+            intensity=self.filter_intensity,
+            gray_mode=self.gray_mode,
+            background_color=self.background_color,
+            bg_threshold=self.bg_threshold
+        )
+    
+    def update_display(self, original_qimg, filtered_qimg):
+        # 介面線程只負責把渲染好的圖片換上
+        self.original_label.setPixmap(QPixmap.fromImage(original_qimg))
+        self.filtered_label.setPixmap(QPixmap.fromImage(filtered_qimg))
+    
+    def process_and_save_all(self):
+        if not self.image_paths:
             return
-        
-        # 獲取濾鏡顏色RGB值
-        color_map = {
-            "red": (255, 0, 0),
-            "green": (0, 255, 0),
-            "blue": (0, 0, 255),
-            "yellow": (255, 255, 0),
-            "purple": (128, 0, 128),
-            "cyan": (0, 255, 255),
-            "orange": (255, 165, 0),
-            "brown": (165, 42, 42),
-            "pink": (255, 192, 203)
-        }
-        
-        r, g, b = color_map[self.filter_color]
-        
-        # 將圖片轉換為numpy數組進行處理
-        img_array = np.array(img)
-        
-        # 如果圖片是RGBA格式，保留Alpha通道
-        if img.mode == "RGBA":
-            # 獲取原始Alpha通道
-            alpha_channel = img_array[:, :, 3]
-            
-            # 應用濾鏡，保持原始顏色的一部分，添加濾鏡顏色的一部分
-            tinted_array = img_array.copy()
-            tinted_array[:, :, 0] = img_array[:, :, 0] * (1 - self.filter_intensity) + r * self.filter_intensity
-            tinted_array[:, :, 1] = img_array[:, :, 1] * (1 - self.filter_intensity) + g * self.filter_intensity
-            tinted_array[:, :, 2] = img_array[:, :, 2] * (1 - self.filter_intensity) + b * self.filter_intensity
-            
-            # 確保值在0-255範圍內
-            tinted_array = np.clip(tinted_array, 0, 255).astype(np.uint8)
-            
-            # 保存處理後的圖片
-            self.current_images[index] = Image.fromarray(tinted_array)
-        else:
-            # 非RGBA圖片處理
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-                img_array = np.array(img)
-            
-            # 應用濾鏡，保持原始顏色的一部分，添加濾鏡顏色的一部分
-            tinted_array = img_array.copy()
-            tinted_array[:, :, 0] = img_array[:, :, 0] * (1 - self.filter_intensity) + r * self.filter_intensity
-            tinted_array[:, :, 1] = img_array[:, :, 1] * (1 - self.filter_intensity) + g * self.filter_intensity
-            tinted_array[:, :, 2] = img_array[:, :, 2] * (1 - self.filter_intensity) + b * self.filter_intensity
-            
-            # 確保值在0-255範圍內
-            tinted_array = np.clip(tinted_array, 0, 255).astype(np.uint8)
-            
-            # 保存處理後的圖片
-            self.current_images[index] = Image.fromarray(tinted_array)
+        self.start_batch(self.current_params())
     
-    def update_display(self):
-        if self.selected_image_index < 0 or not self.original_images:
+    def export_variants(self):
+        if not self.image_paths:
             return
-            
-        # 顯示原始圖片
-        original_img = self.original_images[self.selected_image_index].copy()
-        original_img.thumbnail((500, 300))  # 調整大小以適應顯示區域
-        original_qimg = self.pil_to_qimage(original_img)
-        original_pixmap = QPixmap.fromImage(original_qimg)
-        self.original_label.setPixmap(original_pixmap)
-        
-        # 顯示處理後的圖片
-        if self.current_images[self.selected_image_index] is not None:
-            filtered_img = self.current_images[self.selected_image_index].copy()
-            filtered_img.thumbnail((500, 300))  # 調整大小以適應顯示區域
-            filtered_qimg = self.pil_to_qimage(filtered_img)
-            filtered_pixmap = QPixmap.fromImage(filtered_qimg)
-            self.filtered_label.setPixmap(filtered_pixmap)
+        names = [self.variants_list.item(i).data(Qt.ItemDataRole.UserRole)
+                 for i in range(self.variants_list.count())
+                 if self.variants_list.item(i).checkState() == Qt.CheckState.Checked]
+        if not names:
+            QMessageBox.information(self, "多色匯出", "請先勾選要匯出的顏色")
+            return
+        # 強度、背景顏色和閾值沿用當前設置
+        self.start_batch(variant_params(names, self.filter_intensity, self.background_color, self.bg_threshold))
     
-    def pil_to_qimage(self, pil_image):
-        # 將PIL圖像轉換為QImage
-        if pil_image.mode == "RGB":
-            data = pil_image.convert("RGB").tobytes("raw", "RGB")
-            return QImage(data, pil_image.size[0], pil_image.size[1], pil_image.size[0] * 3, QImage.Format.Format_RGB888)
-        elif pil_image.mode == "RGBA":
-            data = pil_image.convert("RGBA").tobytes("raw", "RGBA")
-            return QImage(data, pil_image.size[0], pil_image.size[1], pil_image.size[0] * 4, QImage.Format.Format_RGBA8888)
-        elif pil_image.mode == "L":
-            # 灰度圖像
-            data = pil_image.tobytes("raw", "L")
-            return QImage(data, pil_image.size[0], pil_image.size[1], pil_image.size[0], QImage.Format.Format_Grayscale8)
-        else:
-            # 轉換其他模式為RGB
-            pil_image = pil_image.convert("RGB")
-            return self.pil_to_qimage(pil_image)
+    def start_batch(self, params):
+        # 在背景線程中以多進程處理，避免介面卡住
+        self.process_all_btn.setEnabled(False)
+        self.export_variants_btn.setEnabled(False)
+        self.progress_dialog = QProgressDialog("正在處理圖片...", "取消", 0, len(self.image_paths), self)
+        self.progress_dialog.setWindowTitle("批量處理")
+        self.progress_dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        self.progress_dialog.setMinimumDuration(0)
+        
+        self.batch_thread = BatchThread(self.image_paths, params, self)
+        self.progress_dialog.canceled.connect(self.batch_thread.cancel)
+        self.batch_thread.progress.connect(self.progress_dialog.setValue)
+        self.batch_thread.finished_with_result.connect(self.on_batch_finished)
+        self.batch_thread.start()
     
-    def process_and_save_all(self):
-        # 處理所有圖片
-        for i in range(len(self.original_images)):
-            # 應用濾鏡
-            self.apply_filter(i)
-            
-            # 保存處理後的圖片
-            self.save_specific_image(i)
+    def on_batch_finished(self, result):
+        self.batch_thread.wait()
+        self.progress_dialog.reset()
+        self.process_all_btn.setEnabled(True)
+        self.export_variants_btn.setEnabled(True)
         
         # 顯示完成消息
-        QMessageBox.information(self, "處理完成", f"已處理並保存 {len(self.original_images)} 張圖片")
+        message = f"已處理並保存 {len(result.saved)} 張圖片"
+        if result.cancelled:
+            message += "（已取消）"
+        if result.errors:
+            details = "\n".join(f"{os.path.basename(path)}: {error}" for path, error in result.errors[:20])
+            QMessageBox.warning(self, "處理完成", f"{message}\n{len(result.errors)} 張圖片處理失敗：\n{details}")
+        else:
+            QMessageBox.information(self, "處理完成", message)
     
     def save_image(self):
-        if self.selected_image_index < 0 or not self.current_images[self.selected_image_index]:
+        if self.selected_image_index < 0 or self.selected_image_index >= len(self.store):
             return
         
         # 保存當前選中的圖片
@@ -443,27 +477,20 @@ class ColorFilterTool(QMainWindow):
         self.statusBar().showMessage(f"圖片已保存: {file_name}", 3000)
     
     def save_specific_image(self, index):
-        if index < 0 or index >= len(self.image_paths) or not self.current_images[index]:
+        if index < 0 or index >= len(self.store):
             return
         
-        # 獲取原始路徑信息
-        file_path = self.image_paths[index]
-        image_dir = os.path.dirname(file_path)
-        image_name = os.path.basename(file_path)
-        image_name_without_ext, image_ext = os.path.splitext(image_name)
-        
-        # 根據處理模式確定新文件名
-        if self.gray_mode:
-            suffix = "_gray"
-        else:
-            suffix = f"_{self.filter_color}"
-        
-        new_filename = f"{image_name_without_ext}{suffix}{image_ext}"
-        save_path = os.path.join(image_dir, new_filename)
+        # 預覽使用代理圖片，保存時才對全分辨率原圖應用濾鏡
+        params = self.current_params()
+        info = self.store.infos[index]
+        if info.animated or decoded_nbytes(info.size, info.mode) > LARGE_IMAGE_BYTES:
+            # 動畫逐幀處理，超大圖片直接從文件按條帶處理，都不經過緩存
+            process_file(info.path, params)
+            return
+        filtered = self.store.filtered(index, params)
         
-        # 保存圖片
-        self.current_images[index].save(save_path)
-
+        # 文件名為"原文件名_顏色.擴展名"
+        filtered.save(output_path(self.image_paths[index], params))
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
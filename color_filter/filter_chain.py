@@ -0,0 +1,253 @@
+"""
+濾鏡鏈
+
+把多個濾鏡步驟組合成一條鏈，可以用 Python 構建，也可以從 JSON 載入：
+
+    {
+        "suffix": "_team",
+        "stages": [
+            {"type": "gray", "background": [255, 255, 255], "threshold": 30},
+            {"type": "tint", "color": [40, 90, 255], "intensity": 0.4},
+            {"type": "brightness", "factor": 1.1},
+            {"type": "contrast", "factor": 1.2},
+            {"type": "alpha", "factor": 0.9}
+        ]
+    }
+
+編譯時相鄰的逐通道步驟（tint / brightness / contrast / alpha）合併為
+一張查找表，灰度步驟會吸收緊隨其後的查找表，因此N個步驟通常只需
+一到兩次全圖計算。
+"""
+import json
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from color_filter_engine import COLOR_MAP, BackgroundPlanes, gray_from_planes, gray_pixels, tint_lut
+
+_LEVELS = np.arange(256, dtype=np.float64)
+_IDENTITY = np.tile(np.arange(256, dtype=np.uint8), (4, 1))
+
+
+def _clip_table(values):
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+@dataclass(frozen=True)
+class Tint:
+    """顏色濾鏡 c*(1-k) + color*k"""
+    rgb: tuple
+    intensity: float
+
+    def table(self):
+        table = _IDENTITY.copy()
+        table[:3] = np.array(tint_lut(tuple(self.rgb), self.intensity), dtype=np.uint8).reshape(3, 256)
+        return table
+
+
+@dataclass(frozen=True)
+class Brightness:
+    """亮度，與 ImageEnhance.Brightness 相同：c*factor"""
+    factor: float
+
+    def table(self):
+        table = _IDENTITY.copy()
+        table[:3] = _clip_table(_LEVELS * self.factor)
+        return table
+
+
+@dataclass(frozen=True)
+class Contrast:
+    """對比度，以128為中心縮放：(c-128)*factor+128"""
+    factor: float
+
+    def table(self):
+        table = _IDENTITY.copy()
+        table[:3] = _clip_table((_LEVELS - 128) * self.factor + 128)
+        return table
+
+
+@dataclass(frozen=True)
+class Alpha:
+    """透明度：按比例縮放，或按閾值二值化（threshold 不為空時）"""
+    factor: float = 1.0
+    threshold: int = None
+
+    def table(self):
+        table = _IDENTITY.copy()
+        if self.threshold is not None:
+            table[3] = np.where(_LEVELS >= self.threshold, 255, 0)
+        else:
+            table[3] = _clip_table(_LEVELS * self.factor)
+        return table
+
+
+@dataclass(frozen=True)
+class Gray:
+    """灰度（保留背景），與灰度模式相同"""
+    background: tuple = (255, 255, 255)
+    threshold: int = 30
+
+
+@dataclass(frozen=True)
+class Flatten:
+    """移除透明度，將圖片合成到純色背景上"""
+    background: tuple = (255, 255, 255)
+
+
+LUT_STAGES = (Tint, Brightness, Contrast, Alpha)
+
+
+def _parse_rgb(value, name):
+    if isinstance(value, str):
+        if value not in COLOR_MAP:
+            raise ValueError(f"未知的顏色: {value}")
+        return COLOR_MAP[value]
+    value = tuple(int(v) for v in value)
+    if len(value) != 3 or not all(0 <= v <= 255 for v in value):
+        raise ValueError(f"{name} 應為顏色名稱或 [r, g, b]")
+    return value
+
+
+def stage_from_spec(spec):
+    """從字典創建一個步驟"""
+    kind = spec.get("type")
+    if kind == "tint":
+        return Tint(_parse_rgb(spec.get("color", "red"), "color"), float(spec.get("intensity", 0.5)))
+    if kind == "brightness":
+        return Brightness(float(spec["factor"]))
+    if kind == "contrast":
+        return Contrast(float(spec["factor"]))
+    if kind == "alpha":
+        threshold = spec.get("threshold")
+        return Alpha(float(spec.get("factor", 1.0)), None if threshold is None else int(threshold))
+    if kind == "gray":
+        return Gray(_parse_rgb(spec.get("background", (255, 255, 255)), "background"),
+                    int(spec.get("threshold", 30)))
+    if kind == "flatten":
+        return Flatten(_parse_rgb(spec.get("background", (255, 255, 255)), "background"))
+    raise ValueError(f"未知的濾鏡步驟: {kind}")
+
+
+def _flush_table(passes, table):
+    if table is None:
+        return
+    if passes and passes[-1][0] == "gray" and passes[-1][2] is None:
+        # 灰度之後的查找表直接在灰度計算中完成
+        passes[-1] = ("gray", passes[-1][1], table)
+    else:
+        passes.append(("lut", table))
+
+
+class FilterChain:
+    """
+    編譯後的濾鏡鏈，可像 FilterParams 一樣傳給引擎和批量處理
+
+    Args:
+        stages (list): 步驟列表（Tint、Gray、Brightness、Contrast、Alpha、Flatten）
+        suffix (str): 輸出文件名後綴
+    """
+
+    def __init__(self, stages, suffix="_chain"):
+        self.stages = tuple(stages)
+        self.suffix = suffix
+        self.passes = self.compile(self.stages)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """從字典（含 stages 和可選的 suffix）或步驟列表創建"""
+        if isinstance(spec, list):
+            spec = {"stages": spec}
+        stages = [stage_from_spec(stage) for stage in spec.get("stages", [])]
+        return cls(stages, spec.get("suffix", "_chain"))
+
+    @classmethod
+    def load(cls, path):
+        """從JSON文件載入"""
+        with open(path, encoding="utf-8") as f:
+            return cls.from_spec(json.load(f))
+
+    @staticmethod
+    def compile(stages):
+        """
+        將步驟編譯為全圖計算的列表
+
+        Returns:
+            list: ("lut", 表) / ("gray", Gray, 後續的表或None) / ("flatten", Flatten)
+        """
+        passes = []
+        table = None
+        for stage in stages:
+            if isinstance(stage, LUT_STAGES):
+                stage_table = stage.table()
+                # 合併查找表：先查已有的表，再查本步驟的表
+                table = stage_table if table is None else np.take_along_axis(stage_table, table.astype(np.intp), axis=1)
+                continue
+            _flush_table(passes, table)
+            table = None
+            if isinstance(stage, Gray):
+                passes.append(("gray", stage, None))
+            elif isinstance(stage, Flatten):
+                passes.append(("flatten", stage))
+            else:
+                raise ValueError(f"未知的濾鏡步驟: {stage!r}")
+        _flush_table(passes, table)
+        return passes
+
+    def __eq__(self, other):
+        return isinstance(other, FilterChain) and (self.stages, self.suffix) == (other.stages, other.suffix)
+
+    def __hash__(self):
+        return hash((self.stages, self.suffix))
+
+    def apply(self, img, planes=None):
+        """
+        對圖片應用整條濾鏡鏈，返回新的圖片
+
+        planes 為原圖的 BackgroundPlanes，只在第一步就是灰度（作用於原圖本身）時使用。
+        """
+        source = img
+        if img.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in img.getbands() or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha else "RGB")
+
+        for step in self.passes:
+            table = step[2] if step[0] == "gray" else step[1] if step[0] == "lut" else None
+            if img.mode == "RGB" and table is not None and not np.array_equal(table[3], _IDENTITY[3]):
+                # 查找表會改變透明度，需要先加上Alpha通道
+                img = img.convert("RGBA")
+            if step[0] == "lut":
+                img = img.point(table[:len(img.getbands())].tobytes())
+            elif step[0] == "gray":
+                img = _apply_gray(img, step[1], table, planes if img is source else None)
+            else:
+                img = _flatten(img, step[1].background)
+        return img
+
+
+def _apply_gray(img, stage, table, planes=None):
+    # 灰度計算與其後的查找表合併為一次計算
+    pixels = gray_pixels(img)
+    if planes is None:
+        planes = BackgroundPlanes()
+    luminance, distance = planes.compute(pixels, tuple(stage.background))
+
+    if table is None:
+        return gray_from_planes(pixels, luminance, distance, stage.threshold)
+
+    foreground = distance >= stage.threshold * 3
+    output = np.empty_like(pixels)
+    for channel in range(pixels.shape[2]):
+        np.take(table[channel], pixels[:, :, channel], out=output[:, :, channel], mode="clip")
+        if channel < 3:
+            np.copyto(output[:, :, channel], table[channel][luminance], where=foreground)
+    return Image.fromarray(output)
+
+
+def _flatten(img, background):
+    if img.mode != "RGBA":
+        return img
+    flattened = Image.new("RGB", img.size, tuple(background))
+    flattened.paste(img, (0, 0), img)
+    return flattened
@@ -0,0 +1,147 @@
+"""
+延遲解碼的圖片存儲
+
+載入時只記錄路徑和元數據（尺寸、模式），不保留文件句柄；
+需要像素時才解碼，並將解碼後的原圖、代理圖片和濾鏡結果
+放入有字節預算的LRU緩存。灰度模式的預計算平面與所屬的圖片
+放在同一個緩存項中，一起計入預算、一起淘汰。
+濾鏡結果被淘汰後可按參數重新生成。
+"""
+import threading
+
+from PIL import Image
+
+from color_filter_engine import PREVIEW_SIZE, BackgroundPlanes, apply_filter, is_animated_gif, make_proxy
+
+import shared_path  # 使 shared 文件夾中的模塊可以導入
+from image_memory import LRUCache, image_nbytes
+
+# 默認緩存預算：512 MB
+DEFAULT_BUDGET = 512 * 1024 * 1024
+
+
+class ImageInfo:
+    """已載入圖片的元數據"""
+
+    def __init__(self, path, size, mode, format, animated=False):
+        self.path = path
+        self.size = size
+        self.mode = mode
+        self.format = format
+        self.animated = animated
+
+
+class _Entry:
+    """緩存中的一張圖片及其灰度預計算平面"""
+
+    def __init__(self, image):
+        self.image = image
+        self.planes = BackgroundPlanes()
+
+    @property
+    def nbytes(self):
+        return image_nbytes(self.image) + self.planes.nbytes
+
+
+class ImageStore:
+    """
+    圖片列表及其解碼緩存
+
+    Args:
+        budget (int): 解碼圖片緩存的字節預算
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.infos = []
+        self.cache = LRUCache(budget)
+        # 預覽線程與介面線程都會讀取緩存；鎖只保護緩存本身，解碼和濾鏡在鎖外運行
+        self.lock = threading.RLock()
+        self.generation = 0  # 每次 clear 加一，清空前開始的解碼或濾鏡結果不再放入緩存
+
+    def __len__(self):
+        return len(self.infos)
+
+    @property
+    def paths(self):
+        return [info.path for info in self.infos]
+
+    def add(self, path):
+        """只讀取文件頭記錄元數據，成功返回True"""
+        try:
+            with Image.open(path) as img:
+                info = ImageInfo(path, img.size, img.mode, img.format, is_animated_gif(img))
+        except Exception as e:
+            print(f"無法載入圖片 {path}: {e}")
+            return False
+        self.infos.append(info)
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.infos = []
+            self.cache.clear()
+            self.generation += 1
+
+    def _entry(self, key, load):
+        with self.lock:
+            entry = self.cache.get(key)
+            generation = self.generation
+        if entry is not None:
+            return entry
+        # 解碼時不佔用鎖，其他線程仍可讀取已緩存的圖片
+        image = load()
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                entry = _Entry(image)
+                if generation == self.generation:
+                    self.cache.put(key, entry, entry.nbytes)
+            return entry
+
+    def _original_entry(self, index):
+        def load():
+            # 文件在解碼後立即關閉，動畫只解碼第一幀
+            with Image.open(self.infos[index].path) as source:
+                source.load()
+                return source
+        return self._entry(("original", index), load)
+
+    def _proxy_entry(self, index, size):
+        return self._entry(("proxy", index, size), lambda: make_proxy(self.original(index), size))
+
+    def _apply(self, key, entry, params):
+        # 濾鏡可能新算出灰度平面，按新的大小重新計入預算（已被淘汰的不再放回）
+        result = apply_filter(entry.image, params, entry.planes)
+        with self.lock:
+            if self.cache.get(key) is entry:
+                self.cache.put(key, entry, entry.nbytes)
+        return result
+
+    def original(self, index):
+        """返回解碼後的原圖"""
+        return self._original_entry(index).image
+
+    def proxy(self, index, size=PREVIEW_SIZE):
+        """返回顯示尺寸的代理圖片"""
+        return self._proxy_entry(index, size).image
+
+    def filtered_proxy(self, index, params, size=PREVIEW_SIZE):
+        """返回代理圖片的濾鏡結果（預覽用，不緩存結果，但保留灰度平面）"""
+        return self._apply(("proxy", index, size), self._proxy_entry(index, size), params)
+
+    def filtered(self, index, params):
+        """返回全分辨率的濾鏡結果，被淘汰後按參數重新生成"""
+        key = ("filtered", index, params)
+        with self.lock:
+            img = self.cache.get(key)
+            generation = self.generation
+        if img is not None:
+            return img
+        # 全分辨率的濾鏡可能需要數秒，在鎖外運行，預覽線程不必等待
+        img = self._apply(("original", index), self._original_entry(index), params)
+        with self.lock:
+            if generation == self.generation:
+                # 同一張圖片只保留最新參數的結果
+                self.cache.discard(lambda k: k[0] == "filtered" and k[1] == index)
+                self.cache.put(key, img, image_nbytes(img))
+        return img
@@ -0,0 +1,62 @@
+"""
+PIL 到 QImage 的轉換
+
+QImage 只引用外部內存而不擁有它，這裡返回的 QImage 都會持有
+緩衝區的引用，保證在 QImage 存活期間像素數據有效。
+
+預覽用的圖片在工作線程中轉為 Qt 原生格式（ARGB32_Premultiplied / RGB32），
+轉換結果的像素由 Qt 自己持有，介面線程的 QPixmap.fromImage 直接共享這些像素，
+不再複製或轉換格式。整個流程複製兩次像素（tobytes 和轉換格式），都在工作線程中。
+"""
+from PyQt6.QtGui import QImage
+
+
+def _wrap(buffer, width, height, bytes_per_line, fmt):
+    qimg = QImage(buffer, width, height, bytes_per_line, fmt)
+    # QImage 不擁有這塊內存，必須讓緩衝區與 QImage 同生共死
+    qimg._buffer = buffer
+    return qimg
+
+
+def pil_to_qimage(pil_image):
+    """將PIL圖像轉換為QImage，只複製一次像素（tobytes）"""
+    width, height = pil_image.size
+    if pil_image.mode == "RGBA":
+        data = pil_image.tobytes("raw", "RGBA")
+        return _wrap(data, width, height, width * 4, QImage.Format.Format_RGBA8888)
+    if pil_image.mode == "RGB":
+        # RGBX 的填充字節為255，滿足 Qt 對不透明格式的要求
+        data = pil_image.tobytes("raw", "RGBX")
+        return _wrap(data, width, height, width * 4, QImage.Format.Format_RGBX8888)
+    if pil_image.mode == "L":
+        # 灰度圖像
+        data = pil_image.tobytes("raw", "L")
+        return _wrap(data, width, height, width, QImage.Format.Format_Grayscale8)
+
+    # 轉換其他模式，帶透明度的轉為RGBA
+    if pil_image.mode in ("LA", "PA", "RGBa", "La") or "transparency" in pil_image.info:
+        return pil_to_qimage(pil_image.convert("RGBA"))
+    return pil_to_qimage(pil_image.convert("RGB"))
+
+
+def to_display_format(qimg):
+    """
+    轉為 Qt 可直接繪製的格式，結果的像素總是由 Qt 自己持有
+
+    結果會交給 QPixmap 長期使用，不能再引用 _wrap 的緩衝區：
+    已經是目標格式時 convertToFormat 只返回共享同一塊內存的淺拷貝，
+    緩衝區隨原QImage被回收後就會懸空，因此改用 copy。
+    """
+    fmt = QImage.Format.Format_ARGB32_Premultiplied if qimg.hasAlphaChannel() else QImage.Format.Format_RGB32
+    if qimg.format() == fmt:
+        return qimg.copy()
+    return qimg.convertToFormat(fmt)
+
+
+def display_qimage(pil_image):
+    """
+    生成預覽用的QImage，應在工作線程中調用
+
+    介面線程只需 QPixmap.fromImage，像素直接共享，不再有拷貝。
+    """
+    return to_display_format(pil_to_qimage(pil_image))
@@ -0,0 +1,116 @@
+"""
+圖片列表的索引與文件夾掃描
+
+FileIndex 以列表保存順序、以字典保存路徑到位置的映射，去重和查找都是 O(1)；
+排除的圖片也記錄在索引中。scan_images 以 os.scandir 遍歷文件夾並分批返回
+圖片路徑，介面可以在背景線程中掃描，邊掃描邊顯示。不依賴 Qt。
+"""
+import os
+import time
+
+from processor_engine import IMAGE_EXTENSIONS
+
+# 每批最多多少個路徑、最長間隔多少秒返回一次
+SCAN_BATCH_SIZE = 2000
+SCAN_BATCH_INTERVAL = 0.1
+
+
+class FileIndex:
+    """按添加順序排列的圖片路徑，支持按位置取值、len() 和 in"""
+
+    def __init__(self):
+        self.paths = []
+        self.positions = {}  # 路徑 -> 在 paths 中的位置
+        self.excluded = set()  # 不進行批量處理的路徑
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return self.paths[index]
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __contains__(self, path):
+        return path in self.positions
+
+    def add(self, paths):
+        """添加尚未存在的路徑，返回實際添加的路徑列表"""
+        added = []
+        for path in paths:
+            if path not in self.positions:
+                self.positions[path] = len(self.paths)
+                self.paths.append(path)
+                added.append(path)
+        return added
+
+    def index_of(self, path):
+        """返回路徑的位置，不存在時返回-1"""
+        return self.positions.get(path, -1)
+
+    def set_excluded(self, path, excluded):
+        if excluded:
+            self.excluded.add(path)
+        else:
+            self.excluded.discard(path)
+
+    def is_excluded(self, path):
+        return path in self.excluded
+
+    def included(self):
+        """返回未排除的路徑列表"""
+        if not self.excluded:
+            return list(self.paths)
+        return [path for path in self.paths if path not in self.excluded]
+
+
+def scan_images(folder, cancel_event=None, batch_size=SCAN_BATCH_SIZE, interval=SCAN_BATCH_INTERVAL):
+    """
+    遞歸掃描文件夾中的圖片，分批返回路徑列表（生成器）
+
+    順序與 os.walk 相同（先當前目錄的文件，再依次進入子目錄），同一目錄內按名稱排序。
+    os.scandir 的目錄項自帶類型信息，大多數文件系統上無需再 stat 每個文件。
+
+    Args:
+        folder (str): 文件夾
+        cancel_event (threading.Event): 設置後停止掃描
+        batch_size (int): 每批最多的路徑數
+        interval (float): 即使未滿一批，每隔多少秒也返回一次
+    """
+    batch = []
+    last_yield = time.monotonic()
+    stack = [folder]
+    while stack:
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"無法讀取文件夾 {directory}: {e}")
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                    batch.append(entry.path)
+            except OSError:
+                continue
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+                last_yield = time.monotonic()
+        # 倒序壓棧，按名稱順序進入子目錄
+        stack.extend(reversed(subdirs))
+
+        if batch and time.monotonic() - last_yield >= interval:
+            yield batch
+            batch = []
+            last_yield = time.monotonic()
+    if batch:
+        yield batch
@@ -1,13 +1,138 @@
 import sys
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                            QHBoxLayout, QPushButton, QFileDialog, QLabel, 
-                           QListWidget, QSpinBox, QCheckBox, QLineEdit,
-                           QColorDialog, QRadioButton, QButtonGroup, QMessageBox)
-from PyQt6.QtCore import Qt, QPoint
+                           QListView, QSpinBox, QCheckBox, QLineEdit,
+                           QColorDialog, QRadioButton, QButtonGroup, QMessageBox, QComboBox,
+                           QProgressDialog)
+from PyQt6.QtCore import Qt, QPoint, QThread, QTimer, pyqtSignal, QAbstractListModel, QModelIndex
 from PyQt6.QtGui import QPixmap, QImage, QColor, QCursor
-from PIL import Image
 import os
 import re
+import threading
+
+from file_index import FileIndex, scan_images
+from processor_batch import BatchResult, process_images
+from processor_engine import ENCODER_PROFILES, ProcessParams, output_dir_for, parse_mapping
+from preview_cache import DEFAULT_CACHE_DIR, DEFAULT_DISK_BUDGET, PreviewCache, source_pixel
+from rename_rules import RenameRules, find_collisions, load_rules
+
+
+def pil_to_qimage(img):
+    """將RGB或RGBA的PIL圖像轉為QImage（QImage持有自己的像素副本）"""
+    width, height = img.size
+    if img.mode == 'RGBA':
+        return QImage(img.tobytes(), width, height, width * 4, QImage.Format.Format_RGBA8888).copy()
+    return QImage(img.tobytes(), width, height, width * 3, QImage.Format.Format_RGB888).copy()
+
+
+class ProcessThread(QThread):
+    """在背景線程中運行多進程批量處理，通過信號回報進度"""
+    progress = pyqtSignal(int, int)
+    finished_with_result = pyqtSignal(object)
+    
+    def __init__(self, file_paths, params, options, parent=None):
+        super().__init__(parent)
+        self.file_paths = list(file_paths)
+        self.params = params
+        self.options = options  # process_images 的其餘參數
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def run(self):
+        try:
+            result = process_images(
+                self.file_paths, self.params,
+                progress=lambda done, total, path, error: self.progress.emit(done, total),
+                cancel_event=self.cancel_event,
+                **self.options
+            )
+        except Exception as e:
+            # 無論如何都要回報結果，介面才能關閉進度窗口並恢復處理按鈕
+            result = BatchResult(len(self.file_paths))
+            result.output_dir = self.options.get("output_dir")
+            result.errors = [(path, f"批量處理失敗: {e}") for path in self.file_paths]
+        self.finished_with_result.emit(result)
+
+
+class ScanThread(QThread):
+    """在背景線程中掃描文件夾，分批回報找到的圖片"""
+    batch_found = pyqtSignal(list)
+    
+    def __init__(self, folder, parent=None):
+        super().__init__(parent)
+        self.folder = folder
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def run(self):
+        for batch in scan_images(self.folder, self.cancel_event):
+            self.batch_found.emit(batch)
+
+
+class RuleCheckThread(QThread):
+    """在背景線程中檢查重命名規則應用到文件列表後是否有輸出文件名衝突"""
+    finished_with_result = pyqtSignal(object)
+    
+    def __init__(self, file_paths, rules, encoder, parent=None):
+        super().__init__(parent)
+        self.file_paths = file_paths
+        self.rules = rules
+        self.encoder = encoder
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def run(self):
+        collisions = find_collisions(self.file_paths, self.rules, self.encoder, self.cancel_event)
+        if collisions is not None:
+            self.finished_with_result.emit(collisions)
+
+
+class ImageListModel(QAbstractListModel):
+    """
+    文件列表的數據模型，只在視圖需要顯示某一行時才生成文件名，
+    大量圖片也不會為每一行創建控件
+    """
+    
+    def __init__(self, file_index, parent=None):
+        super().__init__(parent)
+        self.file_index = file_index
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.file_index)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.file_index[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return os.path.basename(path)
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return path
+        if role == Qt.ItemDataRole.ForegroundRole and self.file_index.is_excluded(path):
+            return QColor(150, 150, 150)  # 排除的圖片顯示為灰色
+        return None
+    
+    def add_paths(self, paths):
+        """添加尚未在列表中的路徑，返回實際添加的數量"""
+        new_paths = [path for path in dict.fromkeys(paths) if path not in self.file_index]
+        if not new_paths:
+            return 0
+        first = len(self.file_index)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_paths) - 1)
+        self.file_index.add(new_paths)
+        self.endInsertRows()
+        return len(new_paths)
+    
+    def refresh_row(self, row):
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.ForegroundRole])
+
 
 class ImageProcessor(QMainWindow):
     def __init__(self):
@@ -16,13 +141,18 @@ class ImageProcessor(QMainWindow):
         self.setGeometry(100, 100, 1200, 800)
         
         # 初始化變量
-        self.image_files = []
+        self.image_files = FileIndex()  # 圖片路徑及排除狀態，查找和去重都是O(1)
         self.current_index = 0
-        self.excluded_images = set()
+        self.scan_threads = []  # 正在掃描的文件夾
         self.background_color = QColor(255, 255, 255)  # 默認白色
         self.is_picking_color = False  # 是否正在使用吸色器
-        self.current_preview_image = None  # 保存當前預覽圖片
-        self.rename_mapping = {}  # 重命名映射
+        self.current_preview_image = None  # 當前預覽的縮略圖（QImage），供吸色器取色
+        self.current_thumbnail = None  # 當前預覽的縮略圖及原圖尺寸
+        self.preview_cache = PreviewCache()  # 縮略圖緩存與前後圖片預取（磁盤緩存默認關閉）
+        self.rename_rules = None  # 編譯後的重命名規則（規則文件加上輸入框中的映射）
+        self.file_rules = None  # 從規則文件載入的規則
+        self.rule_check_thread = None  # 正在進行的衝突檢查
+        self.rule_check = None  # 上次衝突檢查的 (規則, 圖片列表, 編碼設置, 衝突)
         
         self.init_ui()
         
@@ -49,6 +179,11 @@ class ImageProcessor(QMainWindow):
         left_layout.addWidget(rotate_label)
         left_layout.addWidget(self.rotate_spin)
         
+        # JPEG 無損旋轉：有 jpegtran 時總是使用，沒有時可選擇只寫入EXIF方向
+        self.exif_rotation_checkbox = QCheckBox("JPEG 無 jpegtran 時僅寫入EXIF方向")
+        self.exif_rotation_checkbox.setToolTip("不重新編碼，但不讀取EXIF的程序（如部分遊戲引擎）會顯示未旋轉的圖片")
+        left_layout.addWidget(self.exif_rotation_checkbox)
+        
         # 縮放控制
         scale_label = QLabel("縮放比例 (%):")
         self.scale_spin = QSpinBox()
@@ -89,6 +224,31 @@ class ImageProcessor(QMainWindow):
         
         left_layout.addWidget(padding_group)
         
+        # 畫布調整：先裁掉透明邊緣，填充後再擴展到對齊的尺寸
+        self.trim_checkbox = QCheckBox("裁掉透明邊緣")
+        canvas_control = QWidget()
+        canvas_layout = QHBoxLayout(canvas_control)
+        self.canvas_combo = QComboBox()
+        self.canvas_combo.addItem("畫布不調整", None)
+        self.canvas_combo.addItem("擴展到2的冪", "pow2")
+        self.canvas_combo.addItem("擴展到N的倍數", "multiple")
+        self.multiple_spin = QSpinBox()
+        self.multiple_spin.setRange(2, 1024)
+        self.multiple_spin.setValue(4)
+        self.multiple_spin.setEnabled(False)
+        canvas_layout.addWidget(self.canvas_combo)
+        canvas_layout.addWidget(self.multiple_spin)
+        left_layout.addWidget(self.trim_checkbox)
+        left_layout.addWidget(canvas_control)
+        
+        # 輸出編碼設置
+        encoder_label = QLabel("輸出格式:")
+        self.encoder_combo = QComboBox()
+        for name, profile in ENCODER_PROFILES.items():
+            self.encoder_combo.addItem(profile.label, name)
+        left_layout.addWidget(encoder_label)
+        left_layout.addWidget(self.encoder_combo)
+        
         # 重命名控制
         rename_group = QWidget()
         rename_layout = QVBoxLayout(rename_group)
@@ -119,12 +279,27 @@ class ImageProcessor(QMainWindow):
         mapping_layout.addWidget(mapping_label)
         mapping_layout.addWidget(self.mapping_input)
         
+        # 規則文件（CSV/JSON，支持通配符和正則表達式規則）
+        rules_layout = QHBoxLayout()
+        self.rules_btn = QPushButton("載入規則文件")
+        self.rules_btn.setEnabled(False)
+        self.rules_label = QLabel()
+        self.rules_label.setWordWrap(True)
+        rules_layout.addWidget(self.rules_btn)
+        rules_layout.addWidget(self.rules_label, 1)
+        
+        # 停止輸入一段時間後才解析映射，不在每次按鍵時重新解析
+        self.mapping_timer = QTimer(self)
+        self.mapping_timer.setSingleShot(True)
+        self.mapping_timer.setInterval(300)
+        
         rename_layout.addWidget(rename_label)
         rename_layout.addWidget(self.rename_checkbox)
         rename_layout.addWidget(self.number_mode)
         rename_layout.addWidget(self.mapping_mode)
         rename_layout.addLayout(prefix_layout)
         rename_layout.addLayout(mapping_layout)
+        rename_layout.addLayout(rules_layout)
         
         left_layout.addWidget(rename_group)
         
@@ -132,12 +307,23 @@ class ImageProcessor(QMainWindow):
         self.exclude_checkbox = QCheckBox("排除當前圖片")
         left_layout.addWidget(self.exclude_checkbox)
         
-        # 處理按鈕
+        # 磁盤緩存縮略圖（默認關閉），下次打開同一文件夾時不必重新解碼
+        self.disk_cache_checkbox = QCheckBox("縮略圖寫入磁盤緩存")
+        self.disk_cache_checkbox.setToolTip(
+            f"緩存目錄: {DEFAULT_CACHE_DIR}\n最多 {DEFAULT_DISK_BUDGET // (1024 * 1024)} MB，超出時刪除最久未使用的縮略圖")
+        left_layout.addWidget(self.disk_cache_checkbox)
+        
+        # 處理按鈕（默認跳過上次處理後沒有變化的圖片）
+        self.force_checkbox = QCheckBox("強制重新處理全部圖片")
+        left_layout.addWidget(self.force_checkbox)
         self.process_btn = QPushButton("處理圖片")
         left_layout.addWidget(self.process_btn)
         
-        # 文件列表
-        self.file_list = QListWidget()
+        # 文件列表（虛擬化的列表視圖，只繪製可見的行）
+        self.file_model = ImageListModel(self.image_files, self)
+        self.file_list = QListView()
+        self.file_list.setModel(self.file_model)
+        self.file_list.setUniformItemSizes(True)
         left_layout.addWidget(self.file_list)
         
         # 右側預覽面板
@@ -155,8 +341,11 @@ class ImageProcessor(QMainWindow):
         self.add_folder_btn.clicked.connect(self.add_folder)
         self.add_files_btn.clicked.connect(self.add_files)
         self.process_btn.clicked.connect(self.process_images)
-        self.file_list.currentRowChanged.connect(self.update_preview)
+        self.file_list.selectionModel().currentRowChanged.connect(
+            lambda current, previous: self.update_preview(current.row()))
         self.exclude_checkbox.stateChanged.connect(self.toggle_exclude)
+        self.disk_cache_checkbox.toggled.connect(
+            lambda checked: self.preview_cache.set_cache_dir(DEFAULT_CACHE_DIR if checked else None))
         self.color_btn.clicked.connect(self.choose_color)
         self.picker_btn.clicked.connect(self.toggle_color_picker)
         self.preview_label.mousePressEvent = self.preview_mouse_press
@@ -167,8 +356,13 @@ class ImageProcessor(QMainWindow):
         
         # 添加信號連接
         self.mapping_input.textChanged.connect(self.validate_mapping)
+        self.mapping_timer.timeout.connect(self.compile_rules)
+        self.rules_btn.clicked.connect(self.load_rule_file)
+        self.encoder_combo.currentIndexChanged.connect(lambda index: self.start_rule_check())
         self.mapping_mode.toggled.connect(self.toggle_rename_mode)
         self.number_mode.toggled.connect(self.toggle_rename_mode)
+        self.canvas_combo.currentIndexChanged.connect(
+            lambda index: self.multiple_spin.setEnabled(self.canvas_combo.currentData() == "multiple"))
         
     def toggle_color_picker(self, checked):
         self.is_picking_color = checked
@@ -178,14 +372,15 @@ class ImageProcessor(QMainWindow):
             QApplication.restoreOverrideCursor()
             
     def preview_mouse_press(self, event):
+        # 點擊時讀取原圖的精確顏色，移動時只讀縮略圖
         if self.is_picking_color and self.current_preview_image:
-            self.pick_color_from_image(event.pos())
+            self.pick_color_from_image(event.pos(), exact=True)
             
     def preview_mouse_move(self, event):
         if self.is_picking_color and self.current_preview_image:
             self.pick_color_from_image(event.pos())
             
-    def pick_color_from_image(self, pos):
+    def pick_color_from_image(self, pos, exact=False):
         if not self.current_preview_image:
             return
             
@@ -211,16 +406,32 @@ class ImageProcessor(QMainWindow):
         # 確保坐標在圖片範圍內
         if 0 <= x < image_size.width() and 0 <= y < image_size.height():
             color = self.current_preview_image.pixelColor(x, y)
+            if exact and not self.current_thumbnail.exact:
+                # 縮略圖的顏色是多個像素的平均，按比例換算到原圖坐標後讀取原圖
+                source_width, source_height = self.current_thumbnail.source_size
+                source_x = min(int((x + 0.5) * source_width / image_size.width()), source_width - 1)
+                source_y = min(int((y + 0.5) * source_height / image_size.height()), source_height - 1)
+                try:
+                    color = QColor(*source_pixel(self.image_files[self.current_index], source_x, source_y))
+                except Exception as e:
+                    print(f"無法讀取原圖顏色: {e}")
             self.background_color = color
             self.update_color_preview()
             
     def update_preview(self, index):
         if 0 <= index < len(self.image_files):
             self.current_index = index
-            pixmap = QPixmap(self.image_files[index])
-            if not pixmap.isNull():
+            # 只解碼顯示尺寸的縮略圖，已緩存或預取中的圖片無需再次解碼
+            try:
+                thumbnail = self.preview_cache.get(self.image_files[index])
+            except Exception as e:
+                print(f"無法預覽圖片 {self.image_files[index]}: {e}")
+                thumbnail = None
+            if thumbnail is not None:
                 # 保存當前預覽圖片
-                self.current_preview_image = pixmap.toImage()
+                self.current_thumbnail = thumbnail
+                self.current_preview_image = pil_to_qimage(thumbnail.image)
+                pixmap = QPixmap.fromImage(self.current_preview_image)
                 
                 scaled_pixmap = pixmap.scaled(
                     self.preview_label.size(),
@@ -228,25 +439,29 @@ class ImageProcessor(QMainWindow):
                     Qt.TransformationMode.SmoothTransformation
                 )
                 self.preview_label.setPixmap(scaled_pixmap)
+            
+            # 更新排除複選框狀態（無法預覽的圖片也要更新）
+            self.exclude_checkbox.setChecked(self.image_files.is_excluded(self.image_files[index]))
+            
+            # 在背景預先生成前後幾張的縮略圖
+            self.preview_cache.prefetch(self.image_files, index)
                 
-                # 更新排除複選框狀態
-                self.exclude_checkbox.setChecked(self.image_files[index] in self.excluded_images)
-                
+    def set_current_row(self, row):
+        self.file_list.setCurrentIndex(self.file_model.index(row))
+        
     def show_previous_image(self):
         if self.current_index > 0:
-            self.file_list.setCurrentRow(self.current_index - 1)
+            self.set_current_row(self.current_index - 1)
             
     def show_next_image(self):
         if self.current_index < len(self.image_files) - 1:
-            self.file_list.setCurrentRow(self.current_index + 1)
+            self.set_current_row(self.current_index + 1)
             
     def toggle_exclude(self, state):
         if self.current_index < len(self.image_files):
             current_file = self.image_files[self.current_index]
-            if state == Qt.CheckState.Checked.value:
-                self.excluded_images.add(current_file)
-            else:
-                self.excluded_images.discard(current_file)
+            self.image_files.set_excluded(current_file, state == Qt.CheckState.Checked.value)
+            self.file_model.refresh_row(self.current_index)
                 
     def choose_color(self):
         color = QColorDialog.getColor(self.background_color, self, "選擇背景顏色")
@@ -262,45 +477,78 @@ class ImageProcessor(QMainWindow):
         # 切換重命名模式時更新UI狀態
         self.rename_prefix.setEnabled(self.number_mode.isChecked())
         self.mapping_input.setEnabled(self.mapping_mode.isChecked())
+        self.rules_btn.setEnabled(self.mapping_mode.isChecked())
+        self.start_rule_check()
         
     def validate_mapping(self, text):
-        """驗證映射格式並更新映射字典"""
-        if not text.strip():
-            self.rename_mapping = {}
-            return
-            
-        # 檢查基本格式 [key:value,key:value,...]
-        if not (text.startswith('[') and text.endswith(']')):
+        """輸入映射時重新計時，停止輸入後由 compile_rules 解析"""
+        self.mapping_timer.start()
+    
+    def compile_rules(self):
+        """把規則文件和輸入框中的映射編譯為 RenameRules，並在背景檢查衝突"""
+        self.mapping_timer.stop()
+        rules = self.file_rules.copy() if self.file_rules is not None else RenameRules()
+        text = self.mapping_input.text()
+        try:
+            mapping = parse_mapping(text) if text.strip() else {}
+            # 格式不完整時只使用規則文件
+            for source, target in (mapping or {}).items():
+                rules.add(source, target)
+        except ValueError as e:
+            self.rename_rules = None
+            self.rules_label.setText(f"映射錯誤: {e}")
             return
-            
-        # 提取映射對
-        content = text[1:-1].strip()
-        if not content:
+        self.rename_rules = rules if len(rules) else None
+        self.rules_label.setText(rules.describe() if self.rename_rules else "")
+        self.start_rule_check()
+    
+    def load_rule_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "選擇重命名規則文件", "", "規則文件 (*.csv *.json);;所有文件 (*)")
+        if not path:
             return
-            
         try:
-            # 分割並解析每個映射對
-            pairs = content.split(',')
-            mapping = {}
-            for pair in pairs:
-                if ':' not in pair:
-                    if pair.strip():  # 如果有內容但沒有冒號
-                        key = pair.strip()
-                        mapping[key] = key  # 使用相同的值作為映射
-                    continue
-                    
-                key, value = pair.split(':')
-                key = key.strip()
-                value = value.strip()
-                if key and value:  # 確保鍵和值都不為空
-                    mapping[key] = value
-                    
-            self.rename_mapping = mapping
-            print("當前映射規則：", self.rename_mapping)  # 調試輸出
-            
-        except Exception as e:
-            print(f"映射解析錯誤: {str(e)}")  # 調試輸出
-            self.rename_mapping = {}
+            self.file_rules = load_rules(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "警告", f"無法載入規則文件 {os.path.basename(path)}：\n{e}")
+            return
+        self.rules_btn.setToolTip(path)
+        self.compile_rules()
+    
+    def start_rule_check(self):
+        """在背景檢查當前規則應用到文件列表後的輸出文件名衝突"""
+        if self.rule_check_thread is not None:
+            # 每檢查一千個文件查看一次取消標記，很快就會停止
+            self.rule_check_thread.cancel()
+            self.rule_check_thread.wait()
+            self.rule_check_thread = None
+        if not (self.mapping_mode.isChecked() and self.rename_rules and len(self.image_files)):
+            return
+        file_paths = self.image_files.included()
+        encoder = self.encoder_combo.currentData()
+        thread = RuleCheckThread(file_paths, self.rename_rules, encoder, self)
+        thread.finished_with_result.connect(
+            lambda collisions: self.on_rule_check_finished(thread, file_paths, collisions))
+        thread.finished.connect(thread.deleteLater)
+        self.rule_check_thread = thread
+        thread.start()
+    
+    def on_rule_check_finished(self, thread, file_paths, collisions):
+        if thread is not self.rule_check_thread:
+            return  # 規則或列表已經改變，結果過時
+        self.rule_check_thread = None
+        self.rule_check = (thread.rules, file_paths, thread.encoder, collisions)
+        message = self.rename_rules.describe()
+        if collisions:
+            message += f"；{len(collisions)} 個輸出文件名衝突"
+        self.rules_label.setText(message)
+    
+    def current_collisions(self, file_paths, encoder):
+        """返回當前規則的衝突，背景檢查的結果過時或尚未完成時在此直接計算"""
+        if self.rule_check is not None:
+            rules, checked_paths, checked_encoder, collisions = self.rule_check
+            if rules is self.rename_rules and checked_encoder == encoder and checked_paths == file_paths:
+                return collisions
+        return find_collisions(file_paths, self.rename_rules, encoder)
             
     def process_images(self):
         if not self.image_files:
@@ -313,95 +561,114 @@ class ImageProcessor(QMainWindow):
         should_rename = self.rename_checkbox.isChecked()
         use_mapping = self.mapping_mode.isChecked()
         prefix = self.rename_prefix.text().strip()
-        counter = 1
         
-        # 驗證映射模式的設置
-        if should_rename and use_mapping and not self.rename_mapping:
-            QMessageBox.warning(self, "警告", "請輸入有效的重命名映射格式！\n格式: [a:aa,b:bb,c:cc,...]")
+        # 驗證映射模式的設置（還在等待停止輸入時立即解析）
+        if self.mapping_timer.isActive():
+            self.compile_rules()
+        if should_rename and use_mapping and not self.rename_rules:
+            QMessageBox.warning(self, "警告", "請輸入有效的重命名映射格式或載入規則文件！\n格式: [a:aa,b:bb,c:cc,...]")
             return
             
-        # 創建輸出目錄
-        if self.image_files:
-            first_file_dir = os.path.dirname(self.image_files[0])
-            output_dir = os.path.join(first_file_dir, "processed")
-            os.makedirs(output_dir, exist_ok=True)
+        # 輸出目錄（由 process_images 創建）
+        output_dir = output_dir_for(self.image_files)
             
         # 獲取填充設置
-        should_pad = self.padding_checkbox.isChecked()
-        padding = self.padding_spin.value()
         bg_color = (self.background_color.red(),
                    self.background_color.green(),
                    self.background_color.blue(),
                    255)  # 完全不透明
+        params = ProcessParams(
+            rotation=rotation,
+            scale=scale,
+            padding=self.padding_spin.value() if self.padding_checkbox.isChecked() else None,
+            background=bg_color,
+            jpeg_exif_rotation=self.exif_rotation_checkbox.isChecked(),
+            encoder=self.encoder_combo.currentData(),
+            trim=self.trim_checkbox.isChecked(),
+            pow2=self.canvas_combo.currentData() == "pow2",
+            multiple=self.multiple_spin.value() if self.canvas_combo.currentData() == "multiple" else None
+        )
         
-        for index, file_path in enumerate(self.image_files):
-            if file_path in self.excluded_images:
-                continue
-                
-            try:
-                with Image.open(file_path) as img:
-                    # 確保圖片有alpha通道
-                    if img.mode != 'RGBA':
-                        img = img.convert('RGBA')
-                    
-                    # 旋轉
-                    if rotation != 0:
-                        img = img.rotate(rotation, expand=True)
-                    
-                    # 縮放
-                    if scale != 1.0:
-                        new_size = tuple(int(dim * scale) for dim in img.size)
-                        img = img.resize(new_size, Image.Resampling.LANCZOS)
-                    
-                    # 填充背景
-                    if should_pad:
-                        old_size = img.size
-                        new_size = (old_size[0] + 2*padding, old_size[1] + 2*padding)
-                        new_img = Image.new('RGBA', new_size, bg_color)
-                        new_img.paste(img, (padding, padding), img)
-                        img = new_img
-                    
-                    # 生成新文件名
-                    original_name = os.path.splitext(os.path.basename(file_path))[0]
-                    _, ext = os.path.splitext(file_path)
-                    
-                    if should_rename:
-                        if use_mapping:
-                            # 使用映射模式重命名
-                            if original_name in self.rename_mapping:
-                                new_filename = f"{self.rename_mapping[original_name]}{ext}"
-                            else:
-                                # 如果找不到映射，使用原始文件名
-                                new_filename = f"{original_name}{ext}"
-                        else:
-                            # 使用數字序列重命名
-                            new_filename = f"{prefix}{counter}{ext}" if prefix else f"{counter}{ext}"
-                            counter += 1
-                    else:
-                        # 不重命名，直接使用原始文件名
-                        new_filename = os.path.basename(file_path)
-                    
-                    # 保存到輸出目錄
-                    new_path = os.path.join(output_dir, new_filename)
-                    
-                    # 如果文件已存在，添加編號
-                    if os.path.exists(new_path) and not should_rename:
-                        base_name, ext = os.path.splitext(new_filename)
-                        counter = 1
-                        while os.path.exists(new_path):
-                            new_filename = f"{base_name}_{counter}{ext}"
-                            new_path = os.path.join(output_dir, new_filename)
-                            counter += 1
-                    
-                    img.save(new_path)
-                    print(f"保存文件: {new_path}")  # 調試輸出
-                    
-            except Exception as e:
-                print(f"處理圖片 {file_path} 時發生錯誤: {str(e)}")
-                QMessageBox.warning(self, "錯誤", f"處理圖片 {file_path} 時發生錯誤: {str(e)}")
-                
-        QMessageBox.information(self, "完成", f"處理完成！\n輸出目錄: {output_dir}")
+        file_paths = self.image_files.included()
+        if not file_paths:
+            return
+        # 寫入任何文件之前確認沒有多張圖片映射到同一個文件名
+        if should_rename and use_mapping:
+            collisions = self.current_collisions(file_paths, params.encoder)
+            if collisions:
+                details = "\n".join(f"{name} ← {', '.join(os.path.basename(path) for path in paths)}"
+                                    for name, paths in list(collisions.items())[:10])
+                if len(collisions) > 10:
+                    details += f"\n...（共 {len(collisions)} 個）"
+                reply = QMessageBox.question(
+                    self, "輸出文件名衝突",
+                    f"以下圖片會寫入同一個文件，後處理的會覆蓋先處理的：\n{details}\n\n仍要繼續處理嗎？",
+                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                    QMessageBox.StandardButton.No)
+                if reply != QMessageBox.StandardButton.Yes:
+                    return
+        options = {
+            "output_dir": output_dir,
+            "rename": should_rename,
+            "mapping": self.rename_rules if use_mapping else None,
+            "prefix": prefix,
+            "force": self.force_checkbox.isChecked(),
+        }
+        
+        # 在背景線程中以多進程處理，進度窗口不阻擋主窗口
+        self.process_btn.setEnabled(False)
+        self.progress_dialog = QProgressDialog("正在處理圖片...", "取消", 0, len(file_paths), self)
+        self.progress_dialog.setWindowTitle("批量處理")
+        self.progress_dialog.setWindowModality(Qt.WindowModality.NonModal)
+        self.progress_dialog.setMinimumDuration(0)
+        
+        self.process_thread = ProcessThread(file_paths, params, options, self)
+        self.progress_dialog.canceled.connect(self.process_thread.cancel)
+        self.process_thread.progress.connect(self.update_progress)
+        self.process_thread.finished_with_result.connect(self.on_process_finished)
+        self.process_thread.start()
+    
+    def update_progress(self, done, total):
+        # 跳過沒有變化的圖片後，總數小於選擇的圖片數
+        self.progress_dialog.setMaximum(total)
+        self.progress_dialog.setValue(done)
+    
+    def on_process_finished(self, result):
+        self.process_thread.wait()
+        self.progress_dialog.reset()
+        self.process_btn.setEnabled(True)
+        
+        if result.total == 0 and result.skipped:
+            QMessageBox.information(self, "完成", f"全部 {result.skipped} 張圖片都沒有變化，已跳過\n輸出目錄: {result.output_dir}")
+            return
+        
+        # 彙總報告，不再每個錯誤彈出一次窗口
+        message = f"處理完成！已保存 {len(result.saved)} 張圖片"
+        if result.skipped:
+            message += f"，跳過 {result.skipped} 張沒有變化的圖片"
+        if result.cancelled:
+            message += "（已取消）"
+        message += f"\n輸出目錄: {result.output_dir}"
+        if result.errors:
+            for path, error in result.errors:
+                print(f"處理圖片 {path} 時發生錯誤: {error}")
+            details = "\n".join(f"{os.path.basename(path)}: {error}" for path, error in result.errors[:20])
+            if len(result.errors) > 20:
+                details += f"\n...（其餘 {len(result.errors) - 20} 個錯誤見控制台輸出）"
+            QMessageBox.warning(self, "完成", f"{message}\n{len(result.errors)} 張圖片處理失敗：\n{details}")
+        else:
+            QMessageBox.information(self, "完成", message)
 
+    def closeEvent(self, event):
+        for thread in self.scan_threads:
+            thread.cancel()
+            thread.wait()
+        if self.rule_check_thread is not None:
+            self.rule_check_thread.cancel()
+            self.rule_check_thread.wait()
+        self.preview_cache.shutdown()
+        super().closeEvent(event)
+    
     def eventFilter(self, obj, event):
         if event.type() == event.Type.KeyPress:
             if event.key() == Qt.Key.Key_Left:
@@ -420,15 +687,32 @@ class ImageProcessor(QMainWindow):
     def add_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "選擇文件夾")
         if folder:
-            for root, _, files in os.walk(folder):
-                for file in files:
-                    if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                        full_path = os.path.join(root, file)
-                        if full_path not in self.image_files:
-                            self.image_files.append(full_path)
-                            self.file_list.addItem(file)
-            if self.image_files:
-                self.update_preview(0)
+            # 在背景線程中掃描，找到的圖片分批加入列表
+            thread = ScanThread(folder, self)
+            thread.batch_found.connect(self.add_paths)
+            thread.finished.connect(lambda: self.on_scan_finished(thread))
+            self.scan_threads.append(thread)
+            self.statusBar().showMessage(f"正在掃描 {folder} ...")
+            thread.start()
+    
+    def on_scan_finished(self, thread):
+        if thread in self.scan_threads:
+            self.scan_threads.remove(thread)
+        if not self.scan_threads:
+            self.statusBar().showMessage(f"共 {len(self.image_files)} 張圖片", 5000)
+            self.start_rule_check()
+    
+    def add_paths(self, paths):
+        """添加圖片到列表（已存在的會跳過），列表原本為空時預覽第一張"""
+        was_empty = len(self.image_files) == 0
+        added = self.file_model.add_paths(paths)
+        if self.scan_threads:
+            self.statusBar().showMessage(f"正在掃描... 已找到 {len(self.image_files)} 張圖片")
+        if added and was_empty:
+            self.set_current_row(0)
+        if added and not self.scan_threads:
+            self.start_rule_check()
+        return added
                 
     def add_files(self):
         files, _ = QFileDialog.getOpenFileNames(
@@ -437,12 +721,7 @@ class ImageProcessor(QMainWindow):
             "",
             "Images (*.png *.jpg *.jpeg *.bmp *.gif)"
         )
-        for file in files:
-            if file not in self.image_files:
-                self.image_files.append(file)
-                self.file_list.addItem(os.path.basename(file))
-        if self.image_files and self.file_list.count() == len(files):
-            self.update_preview(0)
+        self.add_paths(files)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
@@ -0,0 +1,258 @@
+"""
+預覽縮略圖緩存
+
+瀏覽圖片時只解碼顯示尺寸的縮略圖（JPEG 以 draft 降低解碼分辨率），
+結果放入有字節預算的LRU緩存。磁盤緩存默認關閉，啟用後縮略圖按路徑、大小和
+修改時間區分寫入磁盤，下次打開同一文件夾時無需再次解碼原圖；磁盤緩存同樣有
+字節預算，超出時按最近使用時間（文件的修改時間）刪除最舊的縮略圖。當前圖片
+前後的幾張在背景線程中預先生成，按住方向鍵瀏覽時不必等待解碼。不依賴 Qt。
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import shared_path  # 使 shared 文件夾中的模塊可以導入
+from image_memory import LRUCache, image_nbytes
+
+# 縮略圖的最長邊，足夠填滿預覽區域
+THUMBNAIL_SIZE = 1024
+# 預先生成當前圖片前後各幾張
+PREFETCH_COUNT = 3
+# 默認緩存預算：256 MB
+DEFAULT_BUDGET = 256 * 1024 * 1024
+# 默認磁盤緩存預算：512 MB，超出後刪除到預算的80%，不必每次寫入都清理
+DEFAULT_DISK_BUDGET = 512 * 1024 * 1024
+DISK_PRUNE_RATIO = 0.8
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "image_processor", "thumbnails")
+
+
+def _display_mode(img):
+    # 縮略圖統一為 RGB 或 RGBA，介面可直接轉為 QImage
+    if img.mode in ('RGB', 'RGBA'):
+        return img
+    if 'A' in img.getbands() or 'transparency' in img.info:
+        return img.convert('RGBA')
+    return img.convert('RGB')
+
+
+class Thumbnail:
+    """縮略圖及原圖尺寸，吸色器按比例換算坐標"""
+
+    def __init__(self, image, source_size):
+        self.image = image
+        self.source_size = source_size
+
+    @property
+    def exact(self):
+        """縮略圖就是原圖尺寸（未縮小）時為True"""
+        return self.image.size == tuple(self.source_size)
+
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE):
+    """解碼顯示尺寸的縮略圖（只縮小不放大），返回 Thumbnail"""
+    with Image.open(path) as img:
+        source_size = img.size
+        ratio = min(size / source_size[0], size / source_size[1], 1.0)
+        target = (max(1, round(source_size[0] * ratio)), max(1, round(source_size[1] * ratio)))
+        # JPEG 直接以不小於目標的分辨率解碼，其他格式的 draft 不做任何事
+        img.draft(None, target)
+        img = _display_mode(img)
+        img.load()
+        # RGBA 的 resize 會先對整張圖預乘Alpha，先按整數倍 reduce 再縮放快得多
+        factor = min(img.size[0] // target[0], img.size[1] // target[1])
+        if factor >= 2:
+            img = img.reduce(factor)
+        if img.size != target:
+            img = img.resize(target, Image.Resampling.LANCZOS)
+        return Thumbnail(img, source_size)
+
+
+def source_pixel(path, x, y):
+    """讀取原圖 (x, y) 的顏色，返回 (r, g, b, a)"""
+    with Image.open(path) as img:
+        return _display_mode(img).convert('RGBA').getpixel((x, y))
+
+
+class PreviewCache:
+    """
+    預覽縮略圖的內存緩存、磁盤緩存與背景預取
+
+    Args:
+        size (int): 縮略圖的最長邊
+        budget (int): 內存緩存的字節預算
+        cache_dir (str): 磁盤緩存目錄，為None時不使用磁盤緩存
+        disk_budget (int): 磁盤緩存的字節預算
+        workers (int): 預取線程數，默認為CPU核心數（最多2個）
+    """
+
+    def __init__(self, size=THUMBNAIL_SIZE, budget=DEFAULT_BUDGET, cache_dir=None, disk_budget=DEFAULT_DISK_BUDGET,
+                 workers=None):
+        self.size = size
+        self.cache = LRUCache(budget)
+        self.cache_dir = cache_dir
+        self.disk_budget = disk_budget
+        self.disk_total = None  # 磁盤緩存的總字節數，第一次寫入時掃描目錄得到
+        self.disk_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers or min(2, os.cpu_count() or 1))
+        self.pending = {}  # 緩存鍵 -> 預取中的 Future
+        self.last_index = None  # 上次預取的位置，用於判斷瀏覽方向
+        # 預取線程與介面線程都會讀寫緩存；已完成的 Future 會在加鎖時直接回調
+        self.lock = threading.RLock()
+
+    def set_cache_dir(self, cache_dir):
+        """更換磁盤緩存目錄，為None時停用磁盤緩存"""
+        with self.disk_lock:
+            self.cache_dir = cache_dir
+            self.disk_total = None
+
+    def _key(self, path):
+        # 文件被修改後鍵也會改變，舊的縮略圖自然不再命中
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, self.size)
+
+    def _disk_path(self, key):
+        digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest + ".png")
+
+    def _load(self, key):
+        # 在預取線程或介面線程中運行：先查磁盤緩存，再解碼原圖
+        path = key[0]
+        disk_path = self._disk_path(key) if self.cache_dir else None
+        if disk_path and os.path.exists(disk_path):
+            try:
+                with Image.open(disk_path) as cached:
+                    cached.load()
+                    source_size = tuple(int(v) for v in cached.text["source_size"].split("x"))
+                # 修改時間記錄最近使用的時間，清理時先刪除最久未使用的
+                os.utime(disk_path)
+                return Thumbnail(cached, source_size)
+            except Exception:
+                pass  # 緩存文件損壞時重新生成
+
+        thumbnail = make_thumbnail(path, self.size)
+        # 沒有縮小的圖片重新解碼也很快，不寫入磁盤
+        if disk_path and not thumbnail.exact:
+            self._save_to_disk(thumbnail, disk_path)
+        return thumbnail
+
+    def _save_to_disk(self, thumbnail, disk_path):
+        from PIL.PngImagePlugin import PngInfo
+        info = PngInfo()
+        info.add_text("source_size", "%dx%d" % tuple(thumbnail.source_size))
+        try:
+            os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+            # 先寫臨時文件再替換，其他線程或進程不會讀到不完整的文件
+            temp_path = f"{disk_path}.{threading.get_ident()}.tmp"
+            thumbnail.image.save(temp_path, "PNG", pnginfo=info, compress_level=1)
+            os.replace(temp_path, disk_path)
+            self._account_disk(os.path.getsize(disk_path))
+        except OSError as e:
+            print(f"無法寫入縮略圖緩存 {disk_path}: {e}")
+
+    def _disk_entries(self):
+        # 磁盤緩存中的縮略圖：[(修改時間, 字節數, 路徑)]
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".png"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # 其他進程剛刪除
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return entries
+
+    def _account_disk(self, nbytes):
+        # 累計寫入的字節數，超出預算時重新掃描目錄（其他進程也可能寫入），刪除最久未使用的縮略圖
+        with self.disk_lock:
+            if self.disk_total is None:
+                self.disk_total = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self.disk_total += nbytes
+            if self.disk_total > self.disk_budget:
+                self.disk_total = self.prune_disk(int(self.disk_budget * DISK_PRUNE_RATIO))
+
+    def prune_disk(self, budget=None):
+        """
+        刪除最久未使用的磁盤緩存，直到總大小不超過 budget（默認為磁盤緩存預算）
+
+        Returns:
+            int: 清理後的總字節數
+        """
+        budget = self.disk_budget if budget is None else budget
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        return total
+
+    def _store(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+            if not future.cancelled() and future.exception() is None:
+                thumbnail = future.result()
+                self.cache.put(key, thumbnail, image_nbytes(thumbnail.image))
+
+    def get(self, path):
+        """返回縮略圖；正在預取時等待預取完成，否則立即在當前線程解碼"""
+        key = self._key(path)
+        with self.lock:
+            thumbnail = self.cache.get(key)
+            if thumbnail is not None:
+                return thumbnail
+            future = self.pending.get(key)
+        if future is not None and not future.cancelled():
+            return future.result()
+
+        thumbnail = self._load(key)
+        with self.lock:
+            self.cache.put(key, thumbnail, image_nbytes(thumbnail.image))
+        return thumbnail
+
+    def prefetch(self, paths, index, count=PREFETCH_COUNT):
+        """
+        在背景預先生成 paths[index] 前後各 count 張的縮略圖
+
+        瀏覽方向上的圖片先生成，較近的優先；不在新範圍內且尚未開始的預取
+        會被取消，快速翻頁時隊列不會堆積。
+        """
+        step_sign = -1 if self.last_index is not None and index < self.last_index else 1
+        self.last_index = index
+        neighbours = [index + step_sign * step for step in range(1, count + 1)]
+        neighbours += [index - step_sign * step for step in range(1, count + 1)]
+
+        wanted = []
+        for neighbour in neighbours:
+            if 0 <= neighbour < len(paths):
+                try:
+                    wanted.append(self._key(paths[neighbour]))
+                except OSError:
+                    continue
+
+        with self.lock:
+            for key, future in list(self.pending.items()):
+                # 取消時會立即回調 _store，由它移除記錄
+                if key not in wanted:
+                    future.cancel()
+            for key in wanted:
+                if key in self.pending or self.cache.get(key) is not None:
+                    continue
+                future = self.executor.submit(self._load, key)
+                self.pending[key] = future
+                future.add_done_callback(lambda done, key=key: self._store(key, done))
+
+    def shutdown(self):
+        """取消尚未開始的預取"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,384 @@
+"""
+圖片批量處理的多進程任務引擎
+
+每張圖片的旋轉、縮放、填充和編碼在獨立進程中並行完成，
+結果按輸入順序整理，錯誤彙總後一次性回報。不依賴 Qt，
+可由圖形介面調用，也可直接在命令列運行：
+
+    python processor_batch.py -r 90 -s 50 sprites/
+    python processor_batch.py --padding 16 --bg 0,0,0 --rename --prefix hero_ -j 8 "sprites/**/*.png"
+    python processor_batch.py --trim --pow2 --padding 2 --bg 0,0,0 sprites/
+    python processor_batch.py --rules names.csv sprites/
+    python processor_batch.py --job icons.json --job tiles.json
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from processor_engine import (ENCODER_PROFILES, IMAGE_EXTENSIONS, OUTPUT_DIR_NAME, ProcessParams, output_dir_for,
+                              parse_mapping, plan_outputs, process_file)
+from processor_manifest import Manifest, file_fingerprint, params_key
+from rename_rules import RenameRules, find_collisions, load_rules
+
+
+class BatchResult:
+    """批量處理結果，saved 與 errors 都按輸入順序排列"""
+
+    def __init__(self, total):
+        self.total = total
+        self.saved = []      # 成功保存的路徑
+        self.errors = []     # (原始路徑, 錯誤訊息)
+        self.fingerprints = {}  # 成功處理的原始路徑 -> 處理時的文件指紋
+        self.skipped = 0     # 沒有變化而跳過的圖片數
+        self.output_dir = None
+        self.cancelled = False
+
+
+def _process_one(file_path, save_path, params):
+    # 在子進程中運行，錯誤以字符串返回，避免異常對象無法跨進程傳遞
+    try:
+        # 先記錄指紋，處理期間文件被修改時下次仍會重新處理
+        fingerprint = file_fingerprint(file_path)
+        return process_file(file_path, save_path, params), None, fingerprint
+    except Exception as e:
+        return None, str(e), None
+
+
+def run_jobs(jobs, params, workers=None, progress=None, cancel_event=None):
+    """
+    並行處理並保存所有圖片
+
+    Args:
+        jobs (list): (原始路徑, 保存路徑) 的列表，見 processor_engine.plan_outputs
+        params (ProcessParams): 處理參數
+        workers (int): 進程數，默認為CPU核心數
+        progress (callable): 每完成一張圖片調用 progress(done, total, file_path, error)
+        cancel_event (threading.Event): 設置後停止提交新任務並盡快返回
+
+    Returns:
+        BatchResult
+    """
+    jobs = list(jobs)
+    result = BatchResult(len(jobs))
+    if not jobs:
+        return result
+
+    workers = workers or os.cpu_count() or 1
+    cancel_event = cancel_event or threading.Event()
+    pending = iter(enumerate(jobs))
+    # 只保持少量任務在途，取消時無需等待整個隊列
+    max_in_flight = workers * 2
+    outcomes = [None] * len(jobs)
+    done_count = 0
+    broken = False  # 有子進程異常退出（如內存不足）後進程池不再可用
+
+    def finish(index, outcome):
+        nonlocal done_count
+        outcomes[index] = outcome
+        done_count += 1
+        if progress:
+            progress(done_count, result.total, jobs[index][0], outcome[1])
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while True:
+            while not broken and not cancel_event.is_set() and len(running) < max_in_flight:
+                index, job = next(pending, (None, None))
+                if job is None:
+                    break
+                try:
+                    running[executor.submit(_process_one, job[0], job[1], params)] = index
+                except BrokenProcessPool as e:
+                    broken = True
+                    finish(index, (None, f"處理進程異常退出: {e}", None))
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                try:
+                    outcome = future.result()
+                except BrokenProcessPool as e:
+                    # 在途的其餘任務也會以同樣的錯誤結束
+                    broken = True
+                    outcome = (None, f"處理進程異常退出: {e}", None)
+                except Exception as e:
+                    outcome = (None, str(e), None)
+                finish(index, outcome)
+
+    # 進程池損壞後尚未提交的圖片同樣記為失敗，已完成的結果照常返回
+    if broken:
+        for index, job in pending:
+            finish(index, (None, "未處理：處理進程異常退出", None))
+
+    # 完成順序不固定，按輸入順序整理結果
+    for (file_path, _), outcome in zip(jobs, outcomes):
+        if outcome is None:
+            continue
+        save_path, error, fingerprint = outcome
+        if error is None:
+            result.saved.append(save_path)
+            result.fingerprints[file_path] = fingerprint
+        else:
+            result.errors.append((file_path, error))
+    result.cancelled = cancel_event.is_set() and done_count < result.total
+    return result
+
+
+def process_images(file_paths, params, output_dir=None, rename=False, mapping=None, prefix="",
+                   force=False, workers=None, progress=None, cancel_event=None):
+    """
+    完整的批量處理流程：決定輸出文件名、跳過沒有變化的圖片、並行處理並更新處理記錄
+
+    Args:
+        file_paths (list): 要處理的圖片路徑
+        params (ProcessParams): 處理參數
+        output_dir (str): 輸出目錄，默認為第一個文件所在目錄下的 processed
+        rename (bool): 是否重命名
+        mapping (dict | RenameRules): 映射模式的 {原文件名: 新文件名} 或編譯後的規則，為None時使用數字序列
+        prefix (str): 數字序列的前綴
+        force (bool): 忽略處理記錄，重新處理全部圖片
+        workers, progress, cancel_event: 見 run_jobs，progress 的 total 不含跳過的圖片
+
+    Returns:
+        BatchResult
+    """
+    file_paths = list(file_paths)
+    if not file_paths:
+        return BatchResult(0)
+    output_dir = output_dir or output_dir_for(file_paths)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 處理前一次性決定所有文件名，上次由同一文件生成的輸出直接覆蓋
+    manifest = Manifest(output_dir)
+    jobs = plan_outputs(file_paths, output_dir, rename, mapping, prefix, owned=manifest.outputs(),
+                        encoder=params.encoder)
+
+    # 跳過原始文件、參數和輸出都沒有變化的圖片
+    rename_rule = None
+    if rename:
+        # 映射只影響輸出文件名，而輸出路徑已在記錄中比較，不必把整個映射寫入每條記錄
+        rename_rule = ["mapping"] if mapping is not None else ["number", prefix]
+    key = params_key(params, rename_rule)
+    if not force:
+        jobs = [job for job in jobs if not manifest.is_current(job[0], job[1], key)]
+
+    result = run_jobs(jobs, params, workers, progress, cancel_event)
+    result.skipped = len(file_paths) - len(jobs)
+    result.output_dir = output_dir
+
+    # 記錄成功處理的圖片，取消時已完成的部分下次也會跳過
+    for source, output in jobs:
+        if source in result.fingerprints:
+            manifest.record(source, output, key, result.fingerprints[source])
+    manifest.save()
+    return result
+
+
+def collect_images(patterns, base_dir=None):
+    """展開文件、文件夾（遞歸）與通配符（支持 **）為圖片路徑列表，相對路徑以 base_dir 為基準"""
+    file_paths = []
+    for pattern in patterns:
+        if base_dir and not os.path.isabs(pattern):
+            pattern = os.path.join(base_dir, pattern)
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                # 不處理之前的輸出
+                dirs[:] = sorted(d for d in dirs if d != OUTPUT_DIR_NAME)
+                for file in sorted(files):
+                    if file.lower().endswith(IMAGE_EXTENSIONS):
+                        file_paths.append(os.path.join(root, file))
+        else:
+            # 通配符匹配到的之前的輸出也不處理，除非明確指定了輸出目錄
+            skip_output = OUTPUT_DIR_NAME not in pattern.replace("\\", "/").split("/")
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if skip_output and OUTPUT_DIR_NAME in os.path.normpath(path).split(os.sep)[:-1]:
+                    continue
+                if path.lower().endswith(IMAGE_EXTENSIONS):
+                    file_paths.append(path)
+    # 保持順序去除重複，數字序列重命名依賴順序
+    return list(dict.fromkeys(os.path.abspath(path) for path in file_paths))
+
+
+def parse_rgb(text):
+    values = tuple(int(v) for v in text.split(','))
+    if len(values) != 3 or not all(0 <= v <= 255 for v in values):
+        raise argparse.ArgumentTypeError("顏色格式應為 r,g,b（0-255）")
+    return values
+
+
+def load_job_file(path):
+    """
+    讀取JSON任務文件，文件可以是一個任務或任務列表，每個任務的鍵與命令列選項相同：
+
+        {"inputs": ["sprites/"], "rotation": 90, "scale": 50, "padding": 16, "bg": [0, 0, 0],
+         "exif_rotation": false, "rename": true, "prefix": "hero_", "mapping": "[a:aa,b:bb]", "rules": "names.csv",
+         "encoder": "png-small", "hardlink": false, "trim": true, "pow2": false, "multiple": 4,
+         "output": "out/", "force": false}
+
+    inputs、output 和 rules（重命名規則文件，見 rename_rules.load_rules）的相對路徑以任務文件所在目錄為基準。
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    specs = data if isinstance(data, list) else [data]
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for spec in specs:
+        if not isinstance(spec, dict) or not spec.get("inputs"):
+            raise ValueError("每個任務必須是包含 inputs 的對象")
+        spec["base_dir"] = base_dir
+    return specs
+
+
+def _job_spec(args):
+    # 命令列選項轉為與任務文件相同的格式
+    return {
+        "inputs": args.inputs, "rotation": args.rotation, "scale": args.scale,
+        "padding": args.padding, "bg": args.bg, "exif_rotation": args.exif_rotation,
+        "encoder": args.encoder, "hardlink": args.hardlink,
+        "trim": args.trim, "pow2": args.pow2, "multiple": args.multiple,
+        "rename": args.rename or args.mapping is not None or args.rules is not None, "prefix": args.prefix,
+        "mapping": args.mapping, "rules": args.rules, "output": args.output, "force": args.force, "base_dir": None,
+    }
+
+
+def run_job_spec(spec, workers=None, progress=None):
+    """按任務描述處理一組圖片，返回 BatchResult；設置錯誤時拋出 ValueError"""
+    bg = spec.get("bg") or (255, 255, 255)
+    if isinstance(bg, str):
+        bg = parse_rgb(bg)
+    scale = spec.get("scale", 100)
+    if not 1 <= scale <= 500:
+        raise ValueError("縮放比例應為 1-500（%）")
+    encoder = spec.get("encoder") or "source"
+    if encoder not in ENCODER_PROFILES:
+        raise ValueError(f"未知的編碼設置: {encoder}（可用: {', '.join(ENCODER_PROFILES)}）")
+    multiple = spec.get("multiple")
+    if multiple is not None and int(multiple) < 1:
+        raise ValueError("畫布倍數應為正整數")
+    params = ProcessParams(
+        rotation=int(spec.get("rotation", 0)),
+        scale=scale / 100.0,
+        padding=spec.get("padding"),
+        background=(*bg, 255),
+        jpeg_exif_rotation=bool(spec.get("exif_rotation", False)),
+        encoder=encoder,
+        hardlink=bool(spec.get("hardlink", False)),
+        trim=bool(spec.get("trim", False)),
+        pow2=bool(spec.get("pow2", False)),
+        multiple=int(multiple) if multiple is not None else None
+    )
+
+    base_dir = spec.get("base_dir")
+    mapping = None
+    if spec.get("rules"):
+        rules_path = spec["rules"]
+        if base_dir:
+            rules_path = os.path.join(base_dir, rules_path)
+        try:
+            mapping = load_rules(rules_path)
+        except OSError as e:
+            raise ValueError(f"無法讀取重命名規則文件: {e}") from None
+    if spec.get("mapping") is not None:
+        entries = spec["mapping"]
+        if isinstance(entries, str):
+            entries = parse_mapping(entries)
+        if not entries:
+            raise ValueError("請輸入有效的重命名映射格式！格式: [a:aa,b:bb,c:cc,...]")
+        # 映射中的項目優先於規則文件
+        mapping = mapping or RenameRules()
+        for source, target in entries.items():
+            mapping.add(source, target)
+
+    file_paths = collect_images(spec["inputs"], base_dir)
+    if not file_paths:
+        raise ValueError(f"找不到任何圖片：{' '.join(spec['inputs'])}")
+    if mapping is not None:
+        # 處理前檢查：多張圖片映射到同一個文件名時後處理的會覆蓋先處理的
+        collisions = find_collisions(file_paths, mapping, params.encoder)
+        if collisions:
+            details = "; ".join(f"{name} <- {', '.join(os.path.basename(path) for path in paths)}"
+                                for name, paths in list(collisions.items())[:10])
+            raise ValueError(f"{len(collisions)} 個輸出文件名衝突: {details}")
+    output_dir = spec.get("output")
+    if output_dir and base_dir:
+        output_dir = os.path.join(base_dir, output_dir)
+
+    return process_images(
+        file_paths, params, output_dir,
+        rename=bool(spec.get("rename", False)) or mapping is not None,
+        mapping=mapping, prefix=spec.get("prefix", ""),
+        force=bool(spec.get("force", False)), workers=workers, progress=progress
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="圖片批量處理（旋轉、縮放、背景填充、重命名）")
+    parser.add_argument("inputs", nargs="*", help="圖片文件、文件夾（遞歸）或通配符（支持 **）")
+    parser.add_argument("-r", "--rotation", type=int, default=0, help="逆時針旋轉角度 -360 到 360")
+    parser.add_argument("-s", "--scale", type=int, default=100, help="縮放比例 1-500（%%）")
+    parser.add_argument("--padding", type=int, default=None, help="背景填充的邊距（像素），不指定時不填充")
+    parser.add_argument("--bg", type=parse_rgb, default=(255, 255, 255), help="背景顏色 r,g,b")
+    parser.add_argument("--exif-rotation", action="store_true",
+                        help="沒有 jpegtran 時，JPEG 只旋轉90度倍數時僅寫入EXIF方向")
+    parser.add_argument("--encoder", choices=list(ENCODER_PROFILES), default="source",
+                        help="輸出編碼設置（見 processor_bench.py encode）")
+    parser.add_argument("--hardlink", action="store_true",
+                        help="不旋轉、不縮放、不填充且保持原格式時以硬鏈接代替複製（輸出與原文件是同一個文件）")
+    parser.add_argument("--trim", action="store_true", help="裁掉完全透明的邊緣（在填充之前）")
+    parser.add_argument("--pow2", action="store_true", help="把畫布擴展到2的冪（原圖居中）")
+    parser.add_argument("--multiple", type=int, default=None, help="把畫布擴展到此數的倍數（原圖居中）")
+    parser.add_argument("--rename", action="store_true", help="按數字序列重命名")
+    parser.add_argument("--prefix", default="", help="數字序列的前綴")
+    parser.add_argument("--mapping", default=None, help="按映射重命名，格式 [a:aa,b:bb,...]")
+    parser.add_argument("--rules", default=None,
+                        help="從CSV或JSON文件載入重命名規則（支持 glob: / re: 模式規則，見 rename_rules.py）")
+    parser.add_argument("-o", "--output", default=None, help="輸出目錄（默認為第一個文件所在目錄下的 processed）")
+    parser.add_argument("--force", action="store_true", help="忽略處理記錄，重新處理全部圖片")
+    parser.add_argument("--job", action="append", default=[], help="JSON任務文件，可指定多次")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="並行進程數（默認為CPU核心數）")
+    args = parser.parse_args(argv)
+
+    specs = []
+    try:
+        for path in args.job:
+            specs.extend(load_job_file(path))
+    except (OSError, ValueError) as e:
+        print(f"錯誤：無法載入任務文件: {e}")
+        return 1
+    if args.inputs:
+        specs.append(_job_spec(args))
+    if not specs:
+        parser.error("請指定圖片或 --job 任務文件")
+
+    def report(done, total, file_path, error):
+        if error:
+            print(f"[{done}/{total}] 處理圖片 {file_path} 時發生錯誤: {error}")
+        else:
+            print(f"[{done}/{total}] {file_path}")
+
+    failed = False
+    for spec in specs:
+        try:
+            result = run_job_spec(spec, workers=args.jobs, progress=report)
+        except (ValueError, argparse.ArgumentTypeError) as e:
+            print(f"錯誤：{e}")
+            failed = True
+            continue
+        except KeyboardInterrupt:
+            print("已取消")
+            return 130
+        print(f"已處理並保存 {len(result.saved)} 張圖片，跳過 {result.skipped} 張沒有變化的圖片，"
+              f"失敗 {len(result.errors)} 張\n輸出目錄: {result.output_dir}")
+        failed = failed or bool(result.errors)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,500 @@
+"""
+圖片批量處理工具性能測試
+
+    python processor_bench.py geometry     # 旋轉+縮放+填充：原流程與單次仿射變換的耗時、內存和差異
+    python processor_bench.py decode       # 縮小時完整解碼與降低分辨率解碼的耗時和峰值內存
+    python processor_bench.py preview      # 方向鍵瀏覽：原來的全尺寸 QPixmap 與縮略圖緩存、預取的每張耗時
+    python processor_bench.py scan         # 添加大文件夾：原來的 os.walk + 列表去重 + QListWidget 與背景掃描 + 列表模型
+    python processor_bench.py plan         # 決定輸出文件名：逐個 os.path.exists 與只掃描一次輸出目錄
+    python processor_bench.py encode       # 各編碼設置的編碼耗時與文件大小（可指定自己的樣本圖片）
+    python processor_bench.py identity     # 只重命名時：解碼後重新編碼與直接複製原文件的耗時
+    python processor_bench.py trim         # 旋轉後的精靈圖：裁掉透明邊緣、擴展到2的冪前後的像素數、文件大小和耗時
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from file_index import FileIndex, scan_images
+from preview_cache import PreviewCache
+from processor_engine import (ENCODER_PROFILES, ProcessParams, decode_for_scale, plan_outputs, process_file,
+                              save_image, transform_image)
+
+import shared_path  # 使 shared 文件夾中的模塊可以導入
+from image_memory import peak_rss_kb
+
+
+def make_frame(width, height):
+    """生成帶漸變、細紋理和透明區域的測試圖片"""
+    x = np.arange(width)
+    y = np.arange(height)
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[:, :, 0] = (x * 255 // max(width - 1, 1)).astype(np.uint8)[None, :]
+    pixels[:, :, 1] = (y * 255 // max(height - 1, 1)).astype(np.uint8)[:, None]
+    # uint8 相加自然對256取模
+    pixels[:, :, 2] = x.astype(np.uint8)[None, :] * 7 + y.astype(np.uint8)[:, None] * 3
+    pixels[:, :, 3] = 255
+    pixels[height // 4:height // 2, width // 4:width // 2, 3] = 0
+    return Image.fromarray(pixels)
+
+
+def legacy_transform(img, params):
+    """原來的流程：旋轉、LANCZOS縮放、新建畫布再貼上"""
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    if params.rotation != 0:
+        img = img.rotate(params.rotation, expand=True)
+    if params.scale != 1.0:
+        img = img.resize(tuple(int(dim * params.scale) for dim in img.size), Image.Resampling.LANCZOS)
+    if params.padding is not None:
+        padding = params.padding
+        new_img = Image.new('RGBA', (img.size[0] + 2 * padding, img.size[1] + 2 * padding), params.background)
+        new_img.paste(img, (padding, padding), img)
+        img = new_img
+    return img
+
+
+METHODS = {"legacy": legacy_transform, "fused": transform_image}
+
+
+def _params(args):
+    return ProcessParams(rotation=args.rotation, scale=args.scale, padding=args.padding)
+
+
+def geometry_worker(args):
+    # 在子進程中運行，輸出峰值RSS（KB）
+    with Image.open(args.path) as img:
+        img.load()
+        if args.method != "none":
+            METHODS[args.method](img, _params(args))
+        print(peak_rss_kb())
+
+
+def bench_geometry(args):
+    params = _params(args)
+    frame = make_frame(args.width, args.height)
+    print(f"RGBA {args.width}x{args.height}，旋轉 {args.rotation}°，縮放 {args.scale}，填充 {args.padding}")
+
+    results = {}
+    for name, method in METHODS.items():
+        results[name] = method(frame, params)
+
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            method(frame, params)
+        elapsed = (time.perf_counter() - start) / args.rounds * 1000
+        print(f"  {name:7s} {elapsed:8.1f} ms")
+
+    # 峰值內存在子進程中測量，避免互相影響（僅限Unix）
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "geometry.png")
+        frame.save(path, compress_level=1)
+        peaks = {}
+        for method in ("none", "legacy", "fused"):
+            command = [sys.executable, os.path.abspath(__file__), "geometry-worker", method, path,
+                       "--rotation", str(args.rotation), "--scale", str(args.scale)]
+            if args.padding is not None:
+                command += ["--padding", str(args.padding)]
+            output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+            peaks[method] = int(output.split()[0]) / 1024
+        print(f"  峰值內存：原流程 +{peaks['legacy'] - peaks['none']:.0f} MB，"
+              f"單次變換 +{peaks['fused'] - peaks['none']:.0f} MB")
+
+    # 按預乘Alpha比較可見的顏色
+    # 不透明的結果為RGB，統一轉為RGBA比較
+    legacy, fused = (np.asarray(results[name].convert("RGBA"), dtype=np.float64) for name in ("legacy", "fused"))
+    legacy[..., :3] *= legacy[..., 3:] / 255
+    fused[..., :3] *= fused[..., 3:] / 255
+    diff = np.abs(legacy - fused)
+    print(f"  與原流程的差異：平均 {diff.mean():.2f}，99% 分位 {np.percentile(diff, 99):.1f}（0-255）")
+
+
+def decode_worker(args):
+    # 在子進程中運行，輸出峰值RSS（KB）、耗時（毫秒）和結果尺寸
+    params = ProcessParams(scale=args.scale)
+    start = time.perf_counter()
+    with Image.open(args.path) as img:
+        if args.method == "none":
+            result = img
+        elif args.method == "full":
+            result = transform_image(img, params)
+        else:
+            source_size = img.size
+            decoded, reduction = decode_for_scale(img, params.scale)
+            result = transform_image(decoded, params, source_size, reduction)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(peak_rss_kb(), elapsed, *result.size)
+
+
+def bench_decode(args):
+    """對比完整解碼後縮小與降低分辨率解碼的耗時和峰值內存（僅限Unix）"""
+    print(f"{args.width}x{args.height}，縮放 {args.scale}")
+    with tempfile.TemporaryDirectory() as tmp:
+        frame = make_frame(args.width, args.height).convert("RGB")
+        for ext in ("jpg", "png"):
+            path = os.path.join(tmp, f"decode.{ext}")
+            frame.save(path, quality=90) if ext == "jpg" else frame.save(path, compress_level=1)
+            report = {}
+            for method in ("none", "full", "reduced"):
+                command = [sys.executable, os.path.abspath(__file__), "decode-worker", method, path,
+                           "--scale", str(args.scale)]
+                output = subprocess.run(command, capture_output=True, text=True, check=True).stdout.split()
+                report[method] = (int(output[0]) / 1024, float(output[1]), output[2:])
+            baseline = report["none"][0]
+            (full_peak, full_ms, full_size), (reduced_peak, reduced_ms, reduced_size) = report["full"], report["reduced"]
+            print(f"  {ext.upper():4s} 完整解碼 {full_ms:5.0f} ms / 峰值 +{full_peak - baseline:4.0f} MB，"
+                  f"降低分辨率 {reduced_ms:5.0f} ms / 峰值 +{reduced_peak - baseline:4.0f} MB，"
+                  f"輸出尺寸{'一致' if full_size == reduced_size else '不一致'}")
+
+
+def bench_preview(args):
+    """模擬按住方向鍵瀏覽：每隔 interval 毫秒切換到下一張，統計每張的顯示耗時"""
+    import os
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtCore import QSize, Qt
+    from PyQt6.QtGui import QPixmap
+    from PyQt6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    label_size = QSize(800, 760)
+
+    def original(path):
+        # 原來的 update_preview：解碼全尺寸 QPixmap 後平滑縮放
+        pixmap = QPixmap(path)
+        pixmap.toImage()
+        pixmap.scaled(label_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+
+    def browse(show, paths, prefetch=None):
+        timings = []
+        for index, path in enumerate(paths):
+            start = time.perf_counter()
+            show(path)
+            timings.append((time.perf_counter() - start) * 1000)
+            if prefetch:
+                prefetch(paths, index)
+            time.sleep(args.interval / 1000)
+        return timings
+
+    print(f"{args.count} 張 {args.width}x{args.height}，每 {args.interval} ms 切換一張，CPU {os.cpu_count()} 核")
+    with tempfile.TemporaryDirectory() as tmp:
+        frame = make_frame(args.width, args.height)
+        paths = []
+        for index in range(args.count):
+            ext = "jpg" if index % 2 else "png"
+            path = os.path.join(tmp, f"preview{index}.{ext}")
+            frame.convert("RGB").save(path, quality=90) if ext == "jpg" else frame.save(path, compress_level=1)
+            paths.append(path)
+
+        cache_dir = os.path.join(tmp, "thumbnails")
+        results = {"原流程": browse(original, paths)}
+        cache = PreviewCache(cache_dir=cache_dir)
+        results["縮略圖+預取（首次）"] = browse(cache.get, paths, cache.prefetch)
+        results["內存緩存"] = browse(cache.get, paths)
+        cache.shutdown()
+        disk_cache = PreviewCache(cache_dir=cache_dir)
+        results["磁盤緩存"] = browse(disk_cache.get, paths)
+        disk_cache.shutdown()
+        for name, timings in results.items():
+            print(f"  {name:12s} 平均 {np.mean(timings):6.0f} ms，最慢 {max(timings):6.0f} ms")
+    del app
+
+
+def bench_scan(args):
+    """在臨時目錄中生成大量空的圖片文件，比較添加整個文件夾的耗時"""
+    import os
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtWidgets import QApplication, QListView, QListWidget
+    from image_processor import ImageListModel
+    app = QApplication.instance() or QApplication([])
+
+    def original(folder):
+        # 原來的 add_folder：在介面線程中 os.walk，列表查重，每個文件 addItem
+        image_files = []
+        file_list = QListWidget()
+        for root, _, files in os.walk(folder):
+            for file in files:
+                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
+                    full_path = os.path.join(root, file)
+                    if full_path not in image_files:
+                        image_files.append(full_path)
+                        file_list.addItem(file)
+        return len(image_files)
+
+    def indexed(folder):
+        # 現在：scandir 分批掃描，字典查重，列表模型按批插入
+        file_index = FileIndex()
+        model = ImageListModel(file_index)
+        view = QListView()
+        view.setUniformItemSizes(True)
+        view.setModel(model)
+        longest = 0.0
+        for batch in scan_images(folder):
+            start = time.perf_counter()
+            model.add_paths(batch)
+            longest = max(longest, time.perf_counter() - start)
+        return len(file_index), longest
+
+    with tempfile.TemporaryDirectory() as tmp:
+        per_dir = max(1, args.count // args.dirs)
+        for d in range(args.dirs):
+            directory = os.path.join(tmp, f"dir{d:03d}")
+            os.makedirs(directory)
+            for i in range(per_dir):
+                open(os.path.join(directory, f"sprite_{i:05d}.png"), "wb").close()
+        print(f"{per_dir * args.dirs} 個文件，{args.dirs} 個文件夾")
+
+        start = time.perf_counter()
+        count, longest = indexed(tmp)
+        elapsed = time.perf_counter() - start
+        print(f"  背景掃描+列表模型 {elapsed * 1000:8.0f} ms（介面線程每批最長 {longest * 1000:.1f} ms），{count} 張")
+        if args.skip_original:
+            return
+        start = time.perf_counter()
+        count = original(tmp)
+        print(f"  原流程           {(time.perf_counter() - start) * 1000:8.0f} ms（全部在介面線程），{count} 張")
+    del app
+
+
+def legacy_plan_outputs(file_paths, output_dir):
+    """原來的命名方式（不重命名）：衝突時從 _1 開始逐個 os.path.exists"""
+    planned = []
+    reserved = set()
+    for file_path in file_paths:
+        new_filename = os.path.basename(file_path)
+        new_path = os.path.join(output_dir, new_filename)
+        if new_path in reserved or os.path.exists(new_path):
+            base_name, ext = os.path.splitext(new_filename)
+            counter = 1
+            while new_path in reserved or os.path.exists(new_path):
+                new_filename = f"{base_name}_{counter}{ext}"
+                new_path = os.path.join(output_dir, new_filename)
+                counter += 1
+        reserved.add(new_path)
+        planned.append((file_path, new_path))
+    return planned
+
+
+def bench_plan(args):
+    """大量同名圖片輸出到已有大量文件的目錄時，統計決定文件名的耗時和 stat 次數"""
+    import os
+    with tempfile.TemporaryDirectory() as tmp:
+        output_dir = os.path.join(tmp, "processed")
+        os.makedirs(output_dir)
+        # 上次已輸出 existing 張同名圖片（sprite.png、sprite_1.png ...）和其他文件
+        for i in range(args.existing):
+            name = "sprite.png" if i == 0 else f"sprite_{i}.png"
+            open(os.path.join(output_dir, name), "wb").close()
+            open(os.path.join(output_dir, f"other_{i}.png"), "wb").close()
+        file_paths = [os.path.join(tmp, f"set{i}", "sprite.png") for i in range(args.count)]
+        print(f"{args.count} 張同名圖片，輸出目錄已有 {args.existing * 2} 個文件")
+
+        results = {}
+        for name, plan in (("原流程", lambda: legacy_plan_outputs(file_paths, output_dir)),
+                           ("預留索引", lambda: plan_outputs(file_paths, output_dir))):
+            stat_calls = [0]
+            original_stat = os.stat
+
+            def counting_stat(*stat_args, **kwargs):
+                stat_calls[0] += 1
+                return original_stat(*stat_args, **kwargs)
+
+            os.stat = counting_stat
+            try:
+                start = time.perf_counter()
+                results[name] = plan()
+                elapsed = (time.perf_counter() - start) * 1000
+            finally:
+                os.stat = original_stat
+            print(f"  {name:6s} {elapsed:8.0f} ms，stat {stat_calls[0]} 次")
+        print(f"  文件名{'一致' if results['原流程'] == results['預留索引'] else '不一致'}")
+
+
+def sample_images(width, height):
+    """生成兩類樣本：帶透明區域的精靈圖（PNG）和帶噪點的照片類圖片（JPEG）"""
+    sprite = make_frame(width, height)
+    rng = np.random.default_rng(0)
+    photo = np.asarray(make_frame(width, height).convert("RGB"), dtype=np.int16)
+    photo = np.clip(photo + rng.normal(0, 12, photo.shape), 0, 255).astype(np.uint8)
+    return {"精靈圖 PNG": (sprite, ".png"), "照片 JPEG": (Image.fromarray(photo), ".jpg")}
+
+
+def bench_encode(args):
+    """對每類樣本按每個編碼設置保存，統計平均耗時與總字節數"""
+    if args.inputs:
+        from processor_batch import collect_images
+        groups = {}
+        for path in collect_images(args.inputs):
+            ext = os.path.splitext(path)[1].lower()
+            with Image.open(path) as img:
+                img.load()
+                groups.setdefault(f"{ext[1:].upper()} 文件", []).append((img, ext))
+    else:
+        groups = {name: [sample] for name, sample in sample_images(args.width, args.height).items()}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for group, samples in groups.items():
+            print(f"{group}（{len(samples)} 張）")
+            baseline = None
+            for name, profile in ENCODER_PROFILES.items():
+                total_bytes = 0
+                elapsed = 0.0
+                for index, (img, ext) in enumerate(samples):
+                    path = os.path.join(tmp, f"{index}{profile.extension(ext)}")
+                    save_image(img, path, encoder=name)  # 預熱，不計時
+                    start = time.perf_counter()
+                    for _ in range(args.rounds):
+                        save_image(img, path, encoder=name)
+                    elapsed += (time.perf_counter() - start) / args.rounds
+                    total_bytes += os.path.getsize(path)
+                baseline = baseline or total_bytes
+                lossy = "有損" if profile.extension(samples[0][1]) in (".jpg", ".jpeg") else ""
+                print(f"  {name:18s} {elapsed * 1000 / len(samples):7.1f} ms/張 "
+                      f"{total_bytes / 1024:9.1f} KB（{total_bytes / baseline:6.1%}）{lossy}")
+
+
+def bench_identity(args):
+    """不旋轉、不縮放、不填充時，比較原來的解碼+轉RGBA+重新編碼與直接發布原文件"""
+    with tempfile.TemporaryDirectory() as tmp:
+        frame = make_frame(args.width, args.height)
+        sources = []
+        for index in range(args.count):
+            ext = "jpg" if index % 2 else "png"
+            path = os.path.join(tmp, f"source{index}.{ext}")
+            frame.convert("RGB").save(path, quality=90) if ext == "jpg" else frame.save(path)
+            sources.append(path)
+        print(f"{args.count} 張 {args.width}x{args.height}（PNG與JPEG各半），逐張處理")
+
+        def reencode(source, target):
+            # 原來的流程
+            with Image.open(source) as img:
+                save_image(img.convert("RGBA"), target)
+
+        params = ProcessParams()
+        for name, method in (("重新編碼", reencode),
+                             ("複製原文件", lambda source, target: process_file(source, target, params)),
+                             ("硬鏈接", lambda source, target: process_file(
+                                 source, target, ProcessParams(hardlink=True)))):
+            output_dir = os.path.join(tmp, name)
+            os.makedirs(output_dir)
+            start = time.perf_counter()
+            for source in sources:
+                method(source, os.path.join(output_dir, os.path.basename(source)))
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"  {name:8s} {elapsed:8.0f} ms（每張 {elapsed / args.count:6.2f} ms）")
+
+
+def bench_trim(args):
+    """四周留有透明邊距的精靈圖旋轉後保存，比較是否裁掉透明邊緣的輸出"""
+    width, height = args.width, args.height
+    sprite = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    sprite.paste(make_frame(width // 2, height // 2), (width // 4, height // 4))
+    settings = {
+        "不裁剪": {},
+        "裁剪": {"trim": True},
+        "裁剪+填充": {"trim": True, "padding": args.padding},
+        "裁剪+填充+2的冪": {"trim": True, "padding": args.padding, "pow2": True},
+        "裁剪+填充+4的倍數": {"trim": True, "padding": args.padding, "multiple": 4},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "sprite.png")
+        sprite.save(source)
+        print(f"{width}x{height}（內容 {width // 2}x{height // 2} 居中），旋轉 {args.rotation} 度")
+        baseline = None
+        for name, options in settings.items():
+            params = ProcessParams(rotation=args.rotation, background=(0, 0, 0, 255), **options)
+            target = os.path.join(tmp, "out.png")
+            start = time.perf_counter()
+            for _ in range(args.rounds):
+                process_file(source, target, params)
+            elapsed = (time.perf_counter() - start) * 1000 / args.rounds
+            with Image.open(target) as img:
+                size = img.size
+            nbytes = os.path.getsize(target)
+            baseline = baseline or (size[0] * size[1], nbytes)
+            print(f"  {name:12s} {size[0]:5d}x{size[1]:<5d} 像素 {size[0] * size[1] / baseline[0]:6.1%} "
+                  f"文件 {nbytes / 1024:8.1f} KB（{nbytes / baseline[1]:6.1%}） {elapsed:7.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="圖片批量處理工具性能測試")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    def add_geometry_options(subparser):
+        subparser.add_argument("--rotation", type=int, default=30)
+        subparser.add_argument("--scale", type=float, default=0.75)
+        subparser.add_argument("--padding", type=int, default=32)
+
+    geometry_parser = subparsers.add_parser("geometry", help="旋轉+縮放+填充的耗時與內存")
+    geometry_parser.add_argument("--width", type=int, default=2048)
+    geometry_parser.add_argument("--height", type=int, default=1536)
+    geometry_parser.add_argument("--rounds", type=int, default=5)
+    add_geometry_options(geometry_parser)
+    geometry_parser.set_defaults(func=bench_geometry)
+
+    worker_parser = subparsers.add_parser("geometry-worker")
+    worker_parser.add_argument("method", choices=["none", "legacy", "fused"])
+    worker_parser.add_argument("path")
+    add_geometry_options(worker_parser)
+    worker_parser.set_defaults(func=geometry_worker)
+
+    decode_parser = subparsers.add_parser("decode", help="縮小時的解碼耗時與內存")
+    decode_parser.add_argument("--width", type=int, default=6000)
+    decode_parser.add_argument("--height", type=int, default=4000)
+    decode_parser.add_argument("--scale", type=float, default=0.25)
+    decode_parser.set_defaults(func=bench_decode)
+
+    decode_worker_parser = subparsers.add_parser("decode-worker")
+    decode_worker_parser.add_argument("method", choices=["none", "full", "reduced"])
+    decode_worker_parser.add_argument("path")
+    decode_worker_parser.add_argument("--scale", type=float, default=0.25)
+    decode_worker_parser.set_defaults(func=decode_worker)
+
+    preview_parser = subparsers.add_parser("preview", help="方向鍵瀏覽的每張顯示耗時")
+    preview_parser.add_argument("--width", type=int, default=4000)
+    preview_parser.add_argument("--height", type=int, default=3000)
+    preview_parser.add_argument("--count", type=int, default=8)
+    preview_parser.add_argument("--interval", type=int, default=100, help="切換間隔（毫秒），模擬按鍵重複")
+    preview_parser.set_defaults(func=bench_preview)
+
+    scan_parser = subparsers.add_parser("scan", help="添加大文件夾的耗時")
+    scan_parser.add_argument("--count", type=int, default=20000)
+    scan_parser.add_argument("--dirs", type=int, default=20)
+    scan_parser.add_argument("--skip-original", action="store_true", help="文件很多時原流程太慢，只測試新流程")
+    scan_parser.set_defaults(func=bench_scan)
+
+    plan_parser = subparsers.add_parser("plan", help="決定輸出文件名的耗時")
+    plan_parser.add_argument("--count", type=int, default=1000)
+    plan_parser.add_argument("--existing", type=int, default=1000)
+    plan_parser.set_defaults(func=bench_plan)
+
+    encode_parser = subparsers.add_parser("encode", help="各編碼設置的耗時與文件大小")
+    encode_parser.add_argument("inputs", nargs="*", help="樣本圖片、文件夾或通配符，不指定時使用生成的樣本")
+    encode_parser.add_argument("--width", type=int, default=1024)
+    encode_parser.add_argument("--height", type=int, default=1024)
+    encode_parser.add_argument("--rounds", type=int, default=3)
+    encode_parser.set_defaults(func=bench_encode)
+
+    identity_parser = subparsers.add_parser("identity", help="只重命名時重新編碼與複製的耗時")
+    identity_parser.add_argument("--width", type=int, default=1024)
+    identity_parser.add_argument("--height", type=int, default=768)
+    identity_parser.add_argument("--count", type=int, default=200)
+    identity_parser.set_defaults(func=bench_identity)
+
+    trim_parser = subparsers.add_parser("trim", help="裁掉透明邊緣前後的輸出大小")
+    trim_parser.add_argument("--width", type=int, default=1024)
+    trim_parser.add_argument("--height", type=int, default=768)
+    trim_parser.add_argument("--rotation", type=int, default=30)
+    trim_parser.add_argument("--padding", type=int, default=4)
+    trim_parser.add_argument("--rounds", type=int, default=3)
+    trim_parser.set_defaults(func=bench_trim)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
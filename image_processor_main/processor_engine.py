@@ -0,0 +1,509 @@
+"""
+圖片批量處理引擎
+
+不依賴 Qt 的處理流程（旋轉、縮放、背景填充、重命名），供
+image_processor.py（圖形介面）與 processor_batch.py（批量處理）共用。
+"""
+import math
+import os
+import shutil
+import struct
+import subprocess
+from dataclasses import dataclass
+
+from PIL import Image
+
+from processor_writer import OutputNames, atomic_output, copy_output, temp_path_for
+
+OUTPUT_DIR_NAME = "processed"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# 逆時針旋轉角度 -> 無重採樣的轉置
+TRANSPOSE = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+# 逆時針旋轉角度 -> EXIF方向標記（顯示時需要順時針旋轉的角度）
+EXIF_ORIENTATION = {90: 8, 180: 3, 270: 6}
+# reduce 為區域平均，至少保留目標尺寸的倍數，最後一步 LANCZOS 仍有足夠的像素（與 thumbnail 相同）；
+# JPEG 的DCT縮放本身已經過濾波，直接解碼到不小於目標的尺寸
+REDUCING_GAP = 2.0
+
+
+@dataclass(frozen=True)
+class ProcessParams:
+    """
+    單張圖片的處理參數
+
+    rotation: 旋轉角度（逆時針，度）
+    scale: 縮放比例，1.0 為原尺寸
+    padding: 背景填充的邊距（像素），None 表示不填充
+    background: 背景填充顏色 (r, g, b, a)
+    jpeg_exif_rotation: 沒有 jpegtran 時，JPEG 的90度倍數旋轉只改寫EXIF方向標記
+        （不重新編碼，但不讀取EXIF的程序會顯示未旋轉的圖片）
+    encoder: 編碼設置名稱，見 ENCODER_PROFILES
+    hardlink: 不需要處理像素而直接發布原文件時使用硬鏈接（見 processor_writer.copy_output）
+    trim: 旋轉和縮放後、填充前裁掉完全透明的邊緣
+    pow2: 填充後把畫布擴展到2的冪（寬高分別計算），用於上傳為貼圖
+    multiple: 填充後把畫布擴展到此數的倍數，None 表示不擴展
+    """
+    rotation: int = 0
+    scale: float = 1.0
+    padding: int = None
+    background: tuple = (255, 255, 255, 255)
+    jpeg_exif_rotation: bool = False
+    encoder: str = "source"
+    hardlink: bool = False
+    trim: bool = False
+    pow2: bool = False
+    multiple: int = None
+
+    @property
+    def resizes_canvas(self):
+        """是否需要裁剪或擴展畫布"""
+        return self.trim or self.pow2 or bool(self.multiple)
+
+
+@dataclass(frozen=True)
+class EncoderProfile:
+    """
+    輸出編碼設置
+
+    label: 介面上顯示的名稱
+    format: 輸出格式（PIL格式名），None 表示保持原文件的格式
+    options: {格式: 傳給 Image.save 的參數}
+    """
+    label: str
+    format: str = None
+    options: dict = None
+
+    def extension(self, source_ext):
+        """輸出文件的擴展名，保持原格式時沿用原擴展名"""
+        return FORMAT_EXTENSIONS[self.format] if self.format else source_ext
+
+    def save_options(self, file_format):
+        return dict((self.options or {}).get(file_format, {}))
+
+
+FORMAT_EXTENSIONS = {"PNG": ".png", "WEBP": ".webp", "JPEG": ".jpg"}
+# 編碼設置，可用 processor_bench.py encode 比較各設置的編碼耗時和文件大小
+ENCODER_PROFILES = {
+    "source": EncoderProfile("保持原格式（PIL默認參數）"),
+    "source-hq": EncoderProfile("保持原格式（JPEG 品質95、4:4:4）", None, {
+        "JPEG": {"quality": 95, "subsampling": 0},
+    }),
+    "png-fast": EncoderProfile("PNG 快速壓縮", "PNG", {"PNG": {"compress_level": 1}}),
+    "png-small": EncoderProfile("PNG 最小文件", "PNG", {"PNG": {"compress_level": 9, "optimize": True}}),
+    # 無損WebP的 quality 是壓縮力度，默認的 80/4 比 25/1 慢數倍而文件並不更小
+    "webp-lossless": EncoderProfile("WebP 無損", "WEBP", {"WEBP": {"lossless": True, "quality": 25, "method": 1}}),
+    "webp-lossless-fast": EncoderProfile("WebP 無損（快速）", "WEBP", {
+        "WEBP": {"lossless": True, "quality": 0, "method": 0},
+    }),
+    "jpeg-high": EncoderProfile("JPEG 品質95、4:4:4", "JPEG", {"JPEG": {"quality": 95, "subsampling": 0}}),
+    "jpeg-web": EncoderProfile("JPEG 品質85、4:2:0、漸進式", "JPEG", {
+        "JPEG": {"quality": 85, "subsampling": 2, "optimize": True, "progressive": True},
+    }),
+}
+
+
+def geometry(size, rotation, scale, offset=0):
+    """
+    將旋轉（擴展畫布）、縮放和平移合成為一個仿射變換
+
+    旋轉部分與 Image.rotate(rotation, expand=True) 相同，縮放後的尺寸
+    與 resize 前按 int(邊長 * scale) 計算的相同。
+
+    Args:
+        size (tuple): 原圖尺寸
+        rotation (float): 旋轉角度（逆時針，度）
+        scale (float): 縮放比例
+        offset (int): 結果在畫布中的偏移（背景填充的邊距）
+
+    Returns:
+        tuple: (縮放後的尺寸, 輸出坐標到原圖坐標的仿射係數 (a, b, c, d, e, f))
+    """
+    w, h = size
+    angle = -math.radians(rotation)
+    a, b = round(math.cos(angle), 15), round(math.sin(angle), 15)
+    d, e = -b, a
+    # 繞中心旋轉
+    c = a * -(w / 2) + b * -(h / 2) + w / 2
+    f = d * -(w / 2) + e * -(h / 2) + h / 2
+
+    # 擴展畫布以容納旋轉後的整張圖片
+    xs = [a * x + b * y + c for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    ys = [d * x + e * y + f for x, y in ((0, 0), (w, 0), (w, h), (0, h))]
+    rotated_w = math.ceil(max(xs)) - math.floor(min(xs))
+    rotated_h = math.ceil(max(ys)) - math.floor(min(ys))
+    shift_x, shift_y = -(rotated_w - w) / 2, -(rotated_h - h) / 2
+    c, f = a * shift_x + b * shift_y + c, d * shift_x + e * shift_y + f
+
+    # 縮放並平移：輸出坐標 X 對應旋轉後的 (X - offset) * 原邊長 / 新邊長
+    out_size = (int(rotated_w * scale), int(rotated_h * scale))
+    kx, ky = rotated_w / out_size[0], rotated_h / out_size[1]
+    matrix = (a * kx, b * ky, c - (a * kx + b * ky) * offset,
+              d * kx, e * ky, f - (d * kx + e * ky) * offset)
+    return out_size, matrix
+
+
+def _is_opaque(img):
+    if img.mode == 'RGBA':
+        return img.getextrema()[3][0] == 255
+    return 'A' not in img.getbands() and 'transparency' not in img.info
+
+
+def _reducible(img):
+    # reduce 不支持調色板等模式，先轉為RGB或RGBA
+    if img.mode in ('RGB', 'RGBA', 'L'):
+        return img
+    return img.convert('RGB' if _is_opaque(img) else 'RGBA')
+
+
+def trim_alpha(img):
+    """裁掉完全透明的邊緣（Alpha通道的 getbbox），沒有Alpha通道或完全透明時原樣返回"""
+    if img.mode != 'RGBA':
+        return img
+    bbox = img.getchannel('A').getbbox()
+    if bbox is None or bbox == (0, 0) + img.size:
+        return img
+    return img.crop(bbox)
+
+
+def aligned_size(size, pow2=False, multiple=None):
+    """擴展到2的冪和/或 multiple 的倍數後的尺寸"""
+    width, height = size
+    if pow2:
+        width, height = (1 << (dim - 1).bit_length() for dim in (width, height))
+    if multiple:
+        width, height = (-(-dim // multiple) * multiple for dim in (width, height))
+    return width, height
+
+
+def _finish(img, params, padded=False):
+    # 裁掉透明邊緣、填充背景，再擴展到對齊的尺寸
+    if not padded:
+        if params.trim:
+            img = trim_alpha(img)
+        if params.padding is not None:
+            padding = params.padding
+            new_size = (img.size[0] + 2 * padding, img.size[1] + 2 * padding)
+            new_img = Image.new('RGBA', new_size, tuple(params.background))
+            new_img.paste(img, (padding, padding), img)
+            img = new_img
+
+    size = aligned_size(img.size, params.pow2, params.multiple)
+    if size != img.size:
+        # 擴展的部分：有背景填充時使用背景顏色，否則透明；原圖居中
+        if img.mode == 'RGB' and params.padding is not None:
+            canvas = Image.new('RGB', size, tuple(params.background[:3]))
+        else:
+            canvas = Image.new('RGBA', size, tuple(params.background) if params.padding is not None else (0, 0, 0, 0))
+            img = img.convert('RGBA')
+        canvas.paste(img, ((size[0] - img.size[0]) // 2, (size[1] - img.size[1]) // 2))
+        img = canvas
+    return img
+
+
+def _transform_fused(img, params, source_size, reduction):
+    # 旋轉、縮放和填充的偏移合成一次重採樣，直接畫到最終尺寸
+    opaque = params.padding is not None and _is_opaque(img)
+    offset = params.padding if opaque else 0
+    size, matrix = geometry(source_size, params.rotation, params.scale, offset)
+
+    # 仿射變換的雙三次插值沒有抗鋸齒，剩餘的縮放在一半以下時先按整數倍區域平均縮小，
+    # 使剩餘的縮放接近原尺寸
+    remaining = params.scale * reduction
+    factor = int(1 / remaining) if remaining <= 0.5 else 1
+    if factor > 1:
+        img = _reducible(img).reduce(factor)
+    # 矩陣按原圖坐標計算，換算到已縮小的圖片上
+    matrix = tuple(value / (reduction * factor) for value in matrix)
+    if opaque:
+        # 不透明圖片無需合成，旋轉後露出的角落直接填上背景顏色；也沒有透明邊緣可裁
+        canvas_size = (size[0] + 2 * offset, size[1] + 2 * offset)
+        img = img.convert('RGB').transform(
+            canvas_size, Image.Transform.AFFINE, matrix, Image.Resampling.BICUBIC,
+            fillcolor=tuple(params.background[:3]))
+        return _finish(img, params, padded=True)
+
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    img = img.transform(size, Image.Transform.AFFINE, matrix, Image.Resampling.BICUBIC)
+    return _finish(img, params)
+
+
+def decode_for_scale(img, scale):
+    """
+    縮小時以較低的分辨率解碼，返回 (圖片, 縮小倍數)
+
+    JPEG 以 draft 在解碼時直接按 1/2、1/4、1/8 縮小到不小於目標的尺寸，解碼時間
+    和內存都隨之減少；其他格式解碼後先按整數倍 reduce（區域平均，保留 REDUCING_GAP
+    倍的目標尺寸），之後的旋轉和縮放都在小圖上進行。最後由 LANCZOS 縮放到精確尺寸。
+
+    Args:
+        img (PIL.Image): 剛打開、尚未解碼的圖片
+        scale (float): 縮放比例
+    """
+    width, height = img.size
+    if img.format == 'JPEG':
+        if scale > 0.5:
+            return img, 1
+        draft = img.draft(None, (max(1, int(width * scale)), max(1, int(height * scale))))
+        if draft is None:
+            return img, 1
+        # box 為原圖在縮小後圖片中的範圍，比例即DCT縮放的倍數
+        return img, round(width / draft[1][2])
+    if scale * REDUCING_GAP > 0.5:
+        return img, 1
+    wanted = (max(1, int(width * scale * REDUCING_GAP)), max(1, int(height * scale * REDUCING_GAP)))
+    factor = min(width // wanted[0], height // wanted[1])
+    if factor < 2:
+        return img, 1
+    return _reducible(img).reduce(factor), factor
+
+
+def transform_image(img, params, source_size=None, reduction=1):
+    """
+    按參數旋轉、縮放、裁掉透明邊緣並填充背景，需要透明度時返回RGBA圖片
+
+    Args:
+        img (PIL.Image): 原圖，或 decode_for_scale 降低分辨率後的圖片
+        params (ProcessParams): 處理參數
+        source_size (tuple): 降低分辨率前的原圖尺寸，輸出尺寸按它計算
+        reduction (int): 降低分辨率的倍數
+    """
+    source_size = source_size or img.size
+    # 任意角度旋轉並縮小時，合成為一次仿射變換；不縮放時原流程只有一次
+    # 最近鄰旋轉，放大時非可分離的雙三次插值比 LANCZOS 慢約一倍，都仍分步處理
+    if params.rotation % 90 != 0 and params.scale < 1.0:
+        return _transform_fused(img, params, source_size, reduction)
+
+    rotation = params.rotation % 360
+    if (rotation not in TRANSPOSE and rotation != 0) or params.padding is not None:
+        # 任意角度旋轉露出的角落和背景填充需要Alpha通道
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+    elif img.mode not in ('RGB', 'RGBA', 'L') or (params.trim and 'transparency' in img.info):
+        # 帶透明色的 RGB/L 圖片要裁剪透明邊緣時也需要轉為RGBA
+        img = img.convert('RGB' if _is_opaque(img) else 'RGBA')
+
+    # 旋轉：90度的倍數以轉置完成，結果精確且保留原來的模式（如JPEG的RGB）
+    if rotation in TRANSPOSE:
+        img = img.transpose(TRANSPOSE[rotation])
+    elif rotation != 0:
+        img = img.rotate(rotation, expand=True)
+
+    # 縮放：按原圖（旋轉後）的尺寸計算，與是否降低了解碼分辨率無關
+    if params.scale != 1.0:
+        if rotation in TRANSPOSE or rotation == 0:
+            base_size = source_size[::-1] if rotation in (90, 270) else source_size
+        else:
+            base_size = img.size
+        new_size = tuple(int(dim * params.scale) for dim in base_size)
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+    # 裁掉透明邊緣、填充背景、擴展畫布
+    return _finish(img, params)
+
+
+def _jpeg_with_orientation(data, orientation, exif):
+    # 以新的EXIF段替換原有的EXIF段，其餘字節（包括壓縮數據）原樣保留
+    exif[0x0112] = orientation
+    payload = exif.tobytes()
+    segment = b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+    position = 2
+    kept = []
+    insert_at = 0
+    while position + 4 <= len(data) and data[position] == 0xFF and 0xE0 <= data[position + 1] <= 0xEF:
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        marker_segment = data[position:position + 2 + length]
+        if not (data[position + 1] == 0xE1 and marker_segment[4:10] == b'Exif\x00\x00'):
+            kept.append(marker_segment)
+            if data[position + 1] == 0xE0:
+                # EXIF段放在JFIF段之後
+                insert_at = len(kept)
+        position += 2 + length
+    kept.insert(insert_at, segment)
+    return data[:2] + b''.join(kept) + data[position:]
+
+
+def rotate_jpeg_lossless(file_path, save_path, rotation, exif_fallback=False):
+    """
+    不解碼、不重新編碼地旋轉JPEG（90度的倍數），成功返回True
+
+    優先使用 jpegtran 在DCT域中旋轉像素；尺寸不是MCU整數倍等無法完美旋轉時返回False。
+    沒有 jpegtran 且 exif_fallback 為真時，只改寫EXIF方向標記。
+    與解碼後旋轉的結果一致，原有的EXIF方向不參與計算。
+    """
+    rotation %= 360
+    if rotation not in TRANSPOSE:
+        return False
+    jpegtran = shutil.which('jpegtran')
+    if jpegtran:
+        # 解碼流程不保留EXIF，這裡同樣不複製，避免原有的方向標記再次旋轉圖片
+        temp_path = temp_path_for(save_path)
+        command = [jpegtran, '-rotate', str(360 - rotation), '-perfect', '-copy', 'none',
+                   '-outfile', temp_path, file_path]
+        if subprocess.run(command, capture_output=True).returncode == 0:
+            os.replace(temp_path, save_path)
+            return True
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    if not exif_fallback:
+        return False
+    with Image.open(file_path) as img:
+        exif = img.getexif()
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    with atomic_output(save_path) as temp_path:
+        with open(temp_path, 'wb') as f:
+            f.write(_jpeg_with_orientation(data, EXIF_ORIENTATION[rotation], exif))
+    return True
+
+
+def save_image(img, save_path, background=(255, 255, 255, 255), encoder="source"):
+    """
+    按編碼設置保存圖片
+
+    JPEG不支持透明度，帶Alpha的圖片先合成到背景顏色上；
+    其他格式下完全不透明的RGBA圖片保存為RGB，不寫入多餘的Alpha通道。
+    """
+    if os.path.splitext(save_path)[1].lower() in JPEG_EXTENSIONS and img.mode not in ('RGB', 'L', 'CMYK'):
+        flattened = Image.new('RGB', img.size, tuple(background[:3]))
+        rgba = img.convert('RGBA')
+        flattened.paste(rgba, (0, 0), rgba)
+        img = flattened
+    elif img.mode == 'RGBA' and img.getextrema()[3][0] == 255:
+        img = img.convert('RGB')
+    # 先寫臨時文件再替換，臨時文件沒有圖片擴展名，格式按目標路徑決定
+    ext = os.path.splitext(save_path)[1].lower()
+    file_format = Image.registered_extensions().get(ext)
+    if file_format is None:
+        raise ValueError(f"unknown file extension: {ext}")
+    options = ENCODER_PROFILES[encoder].save_options(file_format)
+    with atomic_output(save_path) as temp_path:
+        img.save(temp_path, format=file_format, **options)
+
+
+def is_passthrough(params, source_format, save_path):
+    """
+    不需要任何像素操作且保持原格式時返回True，此時直接發布原文件而不重新編碼
+
+    重新編碼不會提高品質（JPEG 反而有損），保持原格式的編碼設置下複製文件即可；
+    指定了格式的設置（如 png-small）即使格式相同也重新編碼，以獲得設置的壓縮效果。
+    """
+    return (params.rotation % 360 == 0 and params.scale == 1.0 and params.padding is None
+            and not params.resizes_canvas and ENCODER_PROFILES[params.encoder].format is None
+            and Image.registered_extensions().get(os.path.splitext(save_path)[1].lower()) == source_format)
+
+
+def process_file(file_path, save_path, params):
+    """載入、處理並保存單張圖片，返回保存路徑"""
+    with Image.open(file_path) as img:
+        # 只讀取了文件頭，確認是有效圖片且擴展名與實際格式一致後原樣複製
+        if is_passthrough(params, img.format, save_path):
+            copy_output(file_path, save_path, params.hardlink)
+            return save_path
+        lossless = (img.format == 'JPEG' and params.scale == 1.0 and params.padding is None
+                    and not params.resizes_canvas and params.rotation % 360 in TRANSPOSE
+                    and os.path.splitext(save_path)[1].lower() in JPEG_EXTENSIONS)
+        if not lossless or not rotate_jpeg_lossless(file_path, save_path, params.rotation,
+                                                    params.jpeg_exif_rotation):
+            source_size = img.size
+            decoded, reduction = decode_for_scale(img, params.scale)
+            # 不需要轉換時結果就是原圖，必須在文件關閉前保存
+            save_image(transform_image(decoded, params, source_size, reduction), save_path,
+                       params.background, params.encoder)
+    return save_path
+
+
+def output_dir_for(file_paths):
+    """輸出目錄為第一個文件所在目錄下的 processed"""
+    return os.path.join(os.path.dirname(file_paths[0]), OUTPUT_DIR_NAME)
+
+
+def parse_mapping(text):
+    """
+    解析重命名映射 [a:aa,b:bb,...]，只寫 a 時映射為自身
+
+    Returns:
+        dict: {原文件名: 新文件名}；格式不完整（缺少方括號或內容為空）時返回None
+
+    Raises:
+        ValueError: 某一項包含多個冒號
+    """
+    text = text.strip()
+    if not (text.startswith('[') and text.endswith(']')):
+        return None
+    content = text[1:-1].strip()
+    if not content:
+        return None
+
+    mapping = {}
+    for pair in content.split(','):
+        if ':' not in pair:
+            if pair.strip():  # 如果有內容但沒有冒號
+                key = pair.strip()
+                mapping[key] = key  # 使用相同的值作為映射
+            continue
+
+        if pair.count(':') > 1:
+            raise ValueError(f"映射項格式錯誤: {pair.strip()}")
+        key, value = pair.split(':')
+        key = key.strip()
+        value = value.strip()
+        if key and value:  # 確保鍵和值都不為空
+            mapping[key] = value
+    return mapping
+
+
+def plan_outputs(file_paths, output_dir, rename=False, mapping=None, prefix="", owned=None, encoder="source"):
+    """
+    為每個文件決定保存路徑，返回 (原始路徑, 保存路徑) 的列表
+
+    文件名在處理開始前一次性決定，並行處理時結果與逐張處理相同：
+    不重命名時遇到已存在或本批次已使用的文件名會添加編號。
+    輸出目錄只掃描一次（見 processor_writer.OutputNames），不再逐個文件 stat。
+
+    Args:
+        file_paths (list): 要處理的圖片路徑（已去除排除的圖片）
+        output_dir (str): 輸出目錄
+        rename (bool): 是否重命名
+        mapping (dict): 映射模式的 {原文件名: 新文件名}（或 rename_rules.RenameRules），為None時使用數字序列
+        prefix (str): 數字序列的前綴
+        owned (dict): {原始路徑: 上次的輸出路徑}，上次由同一個文件生成的輸出不算衝突
+        encoder (str): 編碼設置名稱（見 ENCODER_PROFILES），決定輸出的擴展名
+    """
+    owned = owned or {}
+    profile = ENCODER_PROFILES[encoder]
+    names = OutputNames(output_dir)
+    planned = []
+    # 數字序列的編號與衝突時添加的編號分開計數
+    number = 1
+    for file_path in file_paths:
+        original_name, ext = os.path.splitext(os.path.basename(file_path))
+        ext = profile.extension(ext)
+
+        if rename:
+            if mapping is not None:
+                # 使用映射模式重命名，找不到映射時使用原始文件名
+                new_filename = f"{mapping.get(original_name, original_name)}{ext}"
+            else:
+                # 使用數字序列重命名
+                new_filename = f"{prefix}{number}{ext}" if prefix else f"{number}{ext}"
+                number += 1
+            # 重命名時直接覆蓋同名文件
+            new_path = names.reserve(new_filename)
+        else:
+            # 不重命名，使用原始文件名，如果文件已存在，添加編號
+            previous = owned.get(file_path)
+            if previous is not None and os.path.dirname(previous) != output_dir:
+                previous = None
+            new_path = names.reserve_unique(f"{original_name}{ext}",
+                                            os.path.basename(previous) if previous else None)
+
+        planned.append((file_path, new_path))
+    return planned
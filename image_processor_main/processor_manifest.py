@@ -0,0 +1,116 @@
+"""
+增量處理的記錄文件
+
+輸出目錄中的 .manifest.json 記錄每個原始文件上次處理時的大小、修改時間、
+內容雜湊值、處理參數和輸出路徑。再次處理時，這些都沒有變化且輸出文件仍在的
+圖片可以跳過；只比較 stat 結果，修改時間變了才重新計算雜湊值。
+每個輸出路徑只屬於最後寫入它的原始文件，被其他文件覆蓋的輸出不再算作最新。
+"""
+import hashlib
+import json
+import os
+from dataclasses import asdict
+
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_fingerprint(path):
+    """返回文件的大小、修改時間（納秒）和內容雜湊值"""
+    stat = os.stat(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+
+def params_key(params, rename_rule=None):
+    """
+    處理參數和重命名規則的字符串表示，任何一項改變都需要重新處理
+
+    Args:
+        params (ProcessParams): 處理參數
+        rename_rule: 可轉為JSON的重命名規則，如 ["number", "前綴"]、["mapping", {...}] 或 None
+    """
+    return json.dumps({"params": asdict(params), "rename": rename_rule}, sort_keys=True, ensure_ascii=False)
+
+
+class Manifest:
+    """
+    輸出目錄的處理記錄
+
+    Args:
+        output_dir (str): 輸出目錄
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = {}  # 原始路徑 -> 記錄
+        self.owners = {}  # 輸出路徑（normcase）-> 生成它的原始路徑，無法確定時為None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == MANIFEST_VERSION:
+            self.entries = data.get("entries", {})
+            self.owners = {}
+            for source, entry in self.entries.items():
+                output = os.path.normcase(entry["output"])
+                # 舊的記錄中可能有多個文件指向同一個輸出，無法判斷現在是誰的內容，都不算最新
+                self.owners[output] = None if output in self.owners else source
+
+    def save(self):
+        # 先寫臨時文件再替換，中斷時不會留下不完整的記錄
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "entries": self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, self.path)
+
+    def outputs(self):
+        """返回 {原始路徑: 上次的輸出路徑}，只包含輸出仍屬於該文件的記錄"""
+        return {source: entry["output"] for source, entry in self.entries.items()
+                if self.owners.get(os.path.normcase(entry["output"])) == source}
+
+    def is_current(self, source, output, key):
+        """原始文件、參數和輸出路徑都與上次相同，輸出文件仍在且沒有被其他文件覆蓋時返回True"""
+        entry = self.entries.get(source)
+        if entry is None or entry["output"] != output or entry["params"] != key:
+            return False
+        if self.owners.get(os.path.normcase(output)) != source:
+            return False
+        if not os.path.exists(output):
+            return False
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        # 修改時間變了但內容可能沒變（如重新複製），比較雜湊值
+        fingerprint = file_fingerprint(source)
+        if fingerprint["hash"] != entry["hash"]:
+            return False
+        entry.update(fingerprint)
+        return True
+
+    def record(self, source, output, key, fingerprint):
+        """記錄一次成功的處理，之前寫入同一個輸出的其他文件的記錄隨之失效"""
+        output_key = os.path.normcase(output)
+        if output_key in self.owners:
+            for other in [other for other, entry in self.entries.items()
+                          if other != source and os.path.normcase(entry["output"]) == output_key]:
+                del self.entries[other]
+        previous = self.entries.get(source)
+        if previous is not None:
+            previous_key = os.path.normcase(previous["output"])
+            if self.owners.get(previous_key) == source:
+                del self.owners[previous_key]
+        self.entries[source] = dict(fingerprint, output=output, params=key)
+        self.owners[output_key] = source
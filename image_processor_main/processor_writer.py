@@ -0,0 +1,136 @@
+"""
+輸出文件的命名與寫入
+
+OutputNames 在規劃文件名前只掃描一次輸出目錄，之後的衝突判斷都在內存中完成，
+同一基本名稱的編號從上次停下的位置繼續，不必每個文件都從 _1 開始逐個 stat。
+atomic_output 先寫入同目錄下的臨時文件，完成後再以 os.replace 替換，
+處理中斷時不會留下不完整的圖片。copy_output 不解碼地發布原文件。
+"""
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+TEMP_SUFFIX = ".tmp"
+
+
+class OutputNames:
+    """
+    輸出目錄的文件名預留索引
+
+    Args:
+        output_dir (str): 輸出目錄，不存在時視為空目錄
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.existing = set()  # 目錄中已有的文件名（normcase）
+        self.reserved = set()  # 本批次已預留的文件名（normcase）
+        self.next_suffix = {}  # (基本名稱, 擴展名) -> 下一個要嘗試的編號
+        try:
+            with os.scandir(output_dir) as entries:
+                self.existing = {os.path.normcase(entry.name) for entry in entries}
+        except FileNotFoundError:
+            pass
+
+    def taken(self, name, owned=None):
+        """文件名已被本批次預留，或已存在且不是 owned（上次由同一文件生成的輸出）"""
+        key = os.path.normcase(name)
+        if key in self.reserved:
+            return True
+        return key in self.existing and (owned is None or os.path.normcase(owned) != key)
+
+    def reserve(self, name):
+        """預留文件名（重命名模式下直接覆蓋，不檢查衝突），返回完整路徑"""
+        self.reserved.add(os.path.normcase(name))
+        return os.path.join(self.output_dir, name)
+
+    def reserve_unique(self, name, owned=None):
+        """
+        預留不衝突的文件名，衝突時添加 _1、_2 ... 編號，返回完整路徑
+
+        Args:
+            name (str): 想要的文件名
+            owned (str): 上次由同一文件生成的輸出文件名，可以直接覆蓋
+        """
+        if not self.taken(name, owned):
+            return self.reserve(name)
+        base_name, ext = os.path.splitext(name)
+        # 上次的輸出是帶編號的同名文件時直接沿用，輸出文件名保持穩定
+        if owned is not None and owned != name and not self.taken(owned, owned):
+            owned_base, owned_ext = os.path.splitext(owned)
+            prefix, _, number = owned_base.rpartition("_")
+            if prefix == base_name and owned_ext == ext and number.isdigit():
+                return self.reserve(owned)
+        counter = self.next_suffix.get((base_name, ext), 1)
+        while True:
+            candidate = f"{base_name}_{counter}{ext}"
+            counter += 1
+            if not self.taken(candidate, owned):
+                break
+        # 較小的編號都已被佔用，下次從這裡繼續
+        self.next_suffix[(base_name, ext)] = counter
+        return self.reserve(candidate)
+
+
+def temp_path_for(save_path):
+    """save_path 同目錄下的臨時文件路徑，文件名以點開頭且不帶圖片擴展名，不會被當作圖片掃描"""
+    directory, name = os.path.split(save_path)
+    return os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}{TEMP_SUFFIX}")
+
+
+@contextmanager
+def atomic_output(save_path):
+    """
+    返回臨時文件路徑，with 塊正常結束後替換為 save_path，出錯時刪除臨時文件
+
+        with atomic_output(save_path) as temp_path:
+            img.save(temp_path, format="PNG")
+    """
+    temp_path = temp_path_for(save_path)
+    try:
+        yield temp_path
+        os.replace(temp_path, save_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _copy_file(source_path, target_path):
+    # copy_file_range 在支持的文件系統上（btrfs、XFS、NFS 4.2 等）共享數據塊或在服務器端複製，
+    # 不支持時（跨設備、舊內核）由 shutil.copyfile 完成
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(source_path, "rb") as source, open(target_path, "wb") as target:
+                remaining = os.fstat(source.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(source.fileno(), target.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    return
+        except OSError:
+            pass
+    shutil.copyfile(source_path, target_path)
+
+
+def copy_output(source_path, save_path, hardlink=False):
+    """
+    把原文件原樣發布為 save_path（同樣先寫臨時文件再替換）
+
+    Args:
+        hardlink (bool): 盡量使用硬鏈接，不佔額外空間；但輸出與原文件是同一個文件，
+            在其他程序中直接修改輸出也會改變原文件。無法鏈接（如跨設備）時複製。
+    """
+    with atomic_output(save_path) as temp_path:
+        if hardlink:
+            try:
+                os.link(source_path, temp_path)
+                return
+            except OSError:
+                pass
+        _copy_file(source_path, temp_path)
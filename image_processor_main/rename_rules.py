@@ -0,0 +1,209 @@
+"""
+映射模式的重命名規則
+
+規則可以在介面中輸入 [a:aa,b:bb]，也可以從CSV或JSON文件載入。除了精確的
+文件名映射，還支持通配符（glob:）和正則表達式（re:）規則，新文件名以 {0}
+（完整的原文件名）、{1}、{2} ... 或 {名稱} 引用匹配的部分，例如：
+
+    hero_*,          char_{1}
+    re:(\\d+)_idle,  idle_{1:0>4}
+
+規則只編譯一次：精確映射放在字典中 O(1) 查找，模式規則按順序嘗試，
+第一個匹配的生效，都不匹配時保持原文件名。不依賴 Qt。
+"""
+import csv
+import json
+import os
+import re
+import string
+
+from processor_engine import ENCODER_PROFILES
+
+GLOB_PREFIX = "glob:"
+REGEX_PREFIX = "re:"
+
+
+def _glob_to_regex(pattern):
+    # * 和 ? 各自成為一個捕獲組，[...] 原樣保留，其餘字符按字面匹配
+    parts = []
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        if char == "*":
+            parts.append("(.*)")
+        elif char == "?":
+            parts.append("(.)")
+        elif char == "[" and "]" in pattern[position + 2:]:
+            end = pattern.index("]", position + 2)
+            body = pattern[position + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append(f"([{body}])")
+            position = end
+        else:
+            parts.append(re.escape(char))
+        position += 1
+    return "".join(parts)
+
+
+def _check_template(template, regex):
+    # 編譯時檢查模板引用的組都存在，不必等到處理時才出錯
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise ValueError(f"模板格式錯誤: {template}（{e}）") from None
+    # 匹配的部分來自文件名，不會包含路徑分隔符，只需檢查模板的固定文字
+    literals = "".join(literal for literal, _, _, _ in parsed)
+    if not template.strip() or "/" in literals or "\\" in literals:
+        raise ValueError(f"模板無效: {template!r}")
+    fields = [field for _, field, _, _ in parsed if field is not None]
+    for field in fields:
+        name = re.match(r"\w*", field).group()
+        if name == "":
+            raise ValueError(f"模板 {template} 請使用 {{0}}、{{1}} 或 {{名稱}} 引用匹配的部分")
+        if name.isdigit() and int(name) > regex.groups:
+            raise ValueError(f"模板 {template} 引用了不存在的第 {name} 組")
+        if not name.isdigit() and name not in regex.groupindex:
+            raise ValueError(f"模板 {template} 引用了不存在的組 {name}")
+    # 格式說明（如 {1:0>4}）也先試一次，組都按字符串處理
+    try:
+        template.format("", *[""] * regex.groups, **dict.fromkeys(regex.groupindex, ""))
+    except (ValueError, IndexError, KeyError, AttributeError) as e:
+        raise ValueError(f"模板格式錯誤: {template}（{e}）") from None
+
+
+def _check_name(name, source):
+    if not name.strip() or "/" in name or "\\" in name:
+        raise ValueError(f"{source} 的新文件名無效: {name!r}")
+
+
+class RenameRules:
+    """
+    編譯後的重命名規則，按原文件名（不含擴展名）查找新文件名
+
+    與字典一樣支持 get(name, default)，可以直接作為 plan_outputs 的 mapping。
+    """
+
+    def __init__(self, mapping=None):
+        self.exact = {}  # 原文件名 -> 新文件名
+        self.patterns = []  # [(規則原文, 編譯後的正則表達式, 模板)]，按添加順序嘗試
+        for source, target in (mapping or {}).items():
+            self.add(source, target)
+
+    def __len__(self):
+        return len(self.exact) + len(self.patterns)
+
+    def copy(self):
+        rules = RenameRules()
+        rules.exact = dict(self.exact)
+        rules.patterns = list(self.patterns)
+        return rules
+
+    def add(self, source, target):
+        """
+        添加一條規則，source 以 glob: 或 re: 開頭時為模式規則，否則為精確的文件名
+
+        Raises:
+            ValueError: 正則表達式或模板無效，或新文件名包含路徑分隔符
+        """
+        source = source.strip()
+        target = target.strip()
+        if source.startswith(REGEX_PREFIX) or source.startswith(GLOB_PREFIX):
+            if source.startswith(REGEX_PREFIX):
+                expression = source[len(REGEX_PREFIX):]
+            else:
+                expression = _glob_to_regex(source[len(GLOB_PREFIX):])
+            try:
+                regex = re.compile(expression)
+            except re.error as e:
+                raise ValueError(f"正則表達式錯誤: {source}（{e}）") from None
+            _check_template(target, regex)
+            self.patterns.append((source, regex, target))
+        elif "*" in source or "?" in source:
+            # 含通配符但沒有前綴時按通配符處理，文件名本身很少包含這些字符
+            self.add(GLOB_PREFIX + source, target)
+        else:
+            if not source:
+                raise ValueError("原文件名不能為空")
+            _check_name(target, source)
+            self.exact[source] = target
+
+    def get(self, name, default=None):
+        """返回 name 的新文件名，沒有規則匹配時返回 default"""
+        target = self.exact.get(name)
+        if target is not None:
+            return target
+        for source, regex, template in self.patterns:
+            match = regex.fullmatch(name)
+            if match:
+                groups = ["" if group is None else group for group in match.groups()]
+                named = {key: value or "" for key, value in match.groupdict().items()}
+                return template.format(match.group(0), *groups, **named)
+        return default
+
+    def describe(self):
+        """規則數量的簡短說明"""
+        return f"{len(self.exact)} 條精確映射，{len(self.patterns)} 條模式規則"
+
+
+def load_rules(path, rules=None):
+    """
+    從文件載入規則，加入 rules（默認為新的 RenameRules）並返回
+
+    CSV 每行為 原文件名,新文件名，空行和以 # 開頭的行忽略；
+    JSON 為 {"原文件名": "新文件名", ...} 或 [["原文件名", "新文件名"], ...]，模式規則按文件中的順序嘗試。
+
+    Raises:
+        OSError: 無法讀取文件
+        ValueError: 文件格式或某條規則錯誤（包含行號或序號）
+    """
+    rules = rules if rules is not None else RenameRules()
+    if os.path.splitext(path)[1].lower() == ".json":
+        with open(path, encoding="utf-8-sig") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = list(data.items())
+        if not isinstance(data, list):
+            raise ValueError("JSON規則文件應為對象或 [原文件名, 新文件名] 列表")
+        for number, entry in enumerate(data, 1):
+            if not (isinstance(entry, (list, tuple)) and len(entry) == 2
+                    and all(isinstance(value, str) for value in entry)):
+                raise ValueError(f"第 {number} 條規則應為兩個字符串: {entry!r}")
+            try:
+                rules.add(*entry)
+            except ValueError as e:
+                raise ValueError(f"第 {number} 條規則: {e}") from None
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            for row in reader:
+                if not "".join(row).strip() or row[0].lstrip().startswith("#"):
+                    continue
+                try:
+                    if len(row) != 2:
+                        raise ValueError(f"應為 原文件名,新文件名: {','.join(row)}")
+                    rules.add(*row)
+                except ValueError as e:
+                    raise ValueError(f"第 {reader.line_num} 行: {e}") from None
+    return rules
+
+
+def find_collisions(file_paths, rules, encoder="source", cancel_event=None):
+    """
+    找出映射後會寫入同一個輸出文件的圖片（後處理的會覆蓋先處理的）
+
+    與 plan_outputs 一樣：沒有規則匹配的圖片保持原文件名，擴展名由編碼設置決定，
+    比較時不區分大小寫的文件系統上按 normcase 處理。
+
+    Returns:
+        dict: {輸出文件名: [原始路徑, ...]}，只包含兩個及以上圖片的文件名；取消時返回None
+    """
+    profile = ENCODER_PROFILES[encoder]
+    targets = {}
+    for number, file_path in enumerate(file_paths):
+        if cancel_event is not None and number % 1000 == 0 and cancel_event.is_set():
+            return None
+        original_name, ext = os.path.splitext(os.path.basename(file_path))
+        new_name = f"{rules.get(original_name, original_name)}{profile.extension(ext)}"
+        targets.setdefault(os.path.normcase(new_name), []).append(file_path)
+    return {name: paths for name, paths in targets.items() if len(paths) > 1}
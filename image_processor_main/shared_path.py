@@ -0,0 +1,11 @@
+"""
+將倉庫根目錄的 shared 文件夾加入模塊搜索路徑
+
+各工具以自己的文件夾為工作目錄運行，導入 shared 中的模塊前先 import shared_path。
+"""
+import os
+import sys
+
+SHARED_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared"))
+if SHARED_DIR not in sys.path:
+    sys.path.append(SHARED_DIR)
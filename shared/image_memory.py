@@ -0,0 +1,61 @@
+"""
+圖片工具共用的內存計量
+
+圖片濾鏡工具和圖片批量處理工具的緩存與性能測試都從這裡導入，
+各工具把倉庫根目錄的 shared 文件夾加入 sys.path 後按模塊名導入。不依賴 Qt。
+"""
+from collections import OrderedDict
+
+
+def image_nbytes(img):
+    """估算解碼後圖片佔用的字節數"""
+    width, height = img.size
+    return width * height * len(img.getbands())
+
+
+class LRUCache:
+    """按字節預算淘汰最久未使用項目的緩存"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.total = 0
+        self.items = OrderedDict()  # key -> (value, nbytes)
+
+    def get(self, key):
+        entry = self.items.get(key)
+        if entry is None:
+            return None
+        self.items.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, nbytes):
+        if key in self.items:
+            self.total -= self.items.pop(key)[1]
+        self.items[key] = (value, nbytes)
+        self.total += nbytes
+        # 至少保留剛放入的項目，即使它本身超出預算
+        while self.total > self.budget and len(self.items) > 1:
+            _, (_, evicted) = self.items.popitem(last=False)
+            self.total -= evicted
+
+    def discard(self, predicate):
+        for key in [key for key in self.items if predicate(key)]:
+            self.total -= self.items.pop(key)[1]
+
+    def clear(self):
+        self.items.clear()
+        self.total = 0
+
+
+def peak_rss_kb():
+    """當前進程的峰值RSS（KB）"""
+    # ru_maxrss 在Linux上會繼承父進程的峰值，優先讀取 VmHWM
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss